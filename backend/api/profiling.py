@@ -0,0 +1,197 @@
+import contextlib
+import heapq
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_REQUEST_PROFILE'
+
+# Списки параметров в IN (...) схлопываются, чтобы запросы, отличающиеся
+# только количеством значений, давали один отпечаток.
+IN_LIST = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+
+current_profile = ContextVar('current_profile', default=None)
+
+
+def fingerprint(sql):
+    return IN_LIST.sub('(%s, ...)', sql)
+
+
+class RequestProfile:
+    """Замер одного запроса: время по разделам и SQL-запросы.
+    Экземпляр подключается к соединениям через execute_wrapper и
+    вызывается на каждый SQL-запрос."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sections = Counter()
+        self.active = Counter()
+        self.queries = 0
+        self.sql_time = 0
+        self.fingerprints = Counter()
+        self.slow_queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.sql_time += duration
+            self.fingerprints[fingerprint(sql)] += 1
+            if duration * 1000 >= settings.REQUEST_PROFILING_SLOW_QUERY_MS:
+                item = (duration, sql)
+                if (len(self.slow_queries)
+                        < settings.REQUEST_PROFILING_SLOW_QUERIES):
+                    heapq.heappush(self.slow_queries, item)
+                else:
+                    heapq.heappushpop(self.slow_queries, item)
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def repeated_queries(self):
+        """Запросы, повторившиеся не меньше порога раз: признак N+1."""
+        return [
+            (sql, count) for sql, count in self.fingerprints.most_common()
+            if count >= settings.REQUEST_PROFILING_REPEATED_QUERIES
+        ]
+
+    def server_timing(self, total):
+        metrics = [
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        metrics.extend(
+            f'{name};dur={duration * 1000:.1f}'
+            for name, duration in self.sections.items())
+        return ', '.join(metrics)
+
+
+@contextlib.contextmanager
+def profile_section(name):
+    """Добавляет время блока к разделу name текущего замера. Вложенные
+    блоки с тем же именем не считаются повторно, поэтому вложенные
+    сериализаторы не удваивают время. Без замера ничего не делает."""
+    profile = current_profile.get()
+    if profile is None or profile.active[name]:
+        yield
+        return
+    profile.active[name] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[name] += time.perf_counter() - started
+        profile.active[name] -= 1
+
+
+class ProfiledSerializerMixin:
+    """Учитывает время сериализации в разделе serializer замера."""
+
+    def to_representation(self, instance):
+        with profile_section('serializer'):
+            return super().to_representation(instance)
+
+
+def authenticated_user(request):
+    """Пользователь запроса по классам аутентификации DRF. Токен DRF
+    проверяет только в представлении, уже после middleware, поэтому для
+    запросов с заголовком X-Request-Profile он проверяется здесь заранее.
+    None, если пользователя определить не удалось."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return user
+    drf_request = Request(request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(drf_request)
+        except APIException:
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+class RequestProfilingMiddleware:
+    """Замеряет запросы к API: общее время, время сериализации, число
+    и суммарное время SQL-запросов, повторяющиеся запросы.
+    Результат отдается заголовком Server-Timing и строкой лога в JSON.
+    Замеряется доля запросов REQUEST_PROFILING_SAMPLE_RATE, поэтому
+    middleware можно держать включенным в продакшене. Отдельный запрос
+    можно замерить заголовком X-Request-Profile в режиме DEBUG или от
+    имени сотрудника."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with contextlib.ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        total = profile.total
+        response['Server-Timing'] = profile.server_timing(total)
+        self.log(request, response, profile, total)
+        return response
+
+    @staticmethod
+    def should_profile(request):
+        sample_rate = settings.REQUEST_PROFILING_SAMPLE_RATE
+        if sample_rate and random.random() < sample_rate:
+            return True
+        if PROFILE_HEADER not in request.META:
+            return False
+        if settings.DEBUG:
+            return True
+        user = authenticated_user(request)
+        return bool(user and user.is_staff)
+
+    @staticmethod
+    def log(request, response, profile, total):
+        match = request.resolver_match
+        repeated = profile.repeated_queries()
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'sql_ms': round(profile.sql_time * 1000, 1),
+            'queries': profile.queries,
+            'sections_ms': {
+                name: round(duration * 1000, 1)
+                for name, duration in profile.sections.items()
+            },
+            'repeated_queries': [
+                {'sql': sql, 'count': count} for sql, count in repeated
+            ],
+        }
+        logger.info('request profile %s', json.dumps(
+            record, ensure_ascii=False))
+        for duration, sql in sorted(profile.slow_queries, reverse=True):
+            logger.warning('slow query %s', json.dumps(
+                {'view': record['view'], 'ms': round(duration * 1000, 1),
+                 'sql': sql}, ensure_ascii=False))
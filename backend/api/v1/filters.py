@@ -1,9 +1,16 @@
+from django.db.models import Count, Exists, OuterRef, Subquery
 from django_filters.rest_framework import FilterSet, filters
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_ingredients, search_recipes
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
+
+    def filter_name(self, queryset, name, value):
+        """Поиск для автодополнения: сначала совпадения по началу
+        названия, затем по подстроке и с опечатками."""
+        return search_ingredients(queryset, value)
 
     class Meta:
         model = Ingredient
@@ -11,15 +18,59 @@ class IngredientFilter(FilterSet):
 
 
 class RecipeFilter(FilterSet):
+    TAGS_MODES = (
+        ('any', 'Любой из тегов'),
+        ('all', 'Все теги'),
+    )
+
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
+    tags_mode = filters.ChoiceFilter(
+        choices=TAGS_MODES,
+        method='filter_tags_mode',
+    )
+
+    search = filters.CharFilter(method='filter_search')
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    ordering = filters.OrderingFilter(
+        fields=('pub_date', 'favorites_count', 'cart_count'),
+    )
+
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по тегам через подзапрос к таблице связи, без JOIN:
+        рецепт попадает в выдачу один раз, сколько бы тегов ни совпало,
+        и DISTINCT не нужен. При tags_mode=all рецепт должен иметь все
+        переданные теги: совпадения считаются одним подзапросом, поэтому
+        стоимость запроса не растет с количеством тегов."""
+        if not value:
+            return queryset
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') != 'all':
+            return queryset.filter(Exists(recipe_tags.filter(tag__in=value)))
+        tag_ids = [tag.id for tag in value]
+        return queryset.alias(
+            matching_tags=Subquery(
+                recipe_tags.filter(tag__in=tag_ids).values('recipe').annotate(
+                    count=Count('tag')).values('count'))
+        ).filter(matching_tags=len(tag_ids))
+
+    def filter_tags_mode(self, queryset, name, value):
+        # Режим учитывается в filter_tags.
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и описанию.
+        Результаты упорядочены по релевантности, если не передан
+        параметр ordering."""
+        return search_recipes(queryset, value)
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
@@ -1,5 +1,81 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
 
 
 class LimitPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+def estimate_count(queryset):
+    """Приблизительное количество строк queryset.
+    На PostgreSQL берется оценка планировщика из EXPLAIN без выполнения
+    запроса, на остальных базах выполняется обычный COUNT(*)."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.count()
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    return plan[0]['Plan']['Plan Rows']
+
+
+class KeysetPagination(CursorPagination):
+    """Постраничный вывод по курсору: следующая страница выбирается
+    условием по ключу сортировки, а не OFFSET, поэтому время ответа не
+    зависит от глубины страницы. Общее количество по умолчанию не
+    считается, параметр count=exact включает точный подсчет,
+    count=approx приблизительный."""
+
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode == 'exact':
+            self.count = queryset.count()
+        elif count_mode == 'approx':
+            self.count = estimate_count(queryset)
+        else:
+            self.count = None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict()
+        if self.count is not None:
+            response['count'] = self.count
+        response['next'] = self.get_next_link()
+        response['previous'] = self.get_previous_link()
+        response['results'] = data
+        return Response(response)
+
+
+class RecipeKeysetPagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class TimelineKeysetPagination(KeysetPagination):
+    """Лента из TimelineEntry. Курсор, как и у RecipeKeysetPagination,
+    хранит дату публикации, поэтому он переживает смену способа выборки
+    ленты."""
+    ordering = ('-pub_date', '-recipe')
+
+
+class SubscriptionKeysetPagination(KeysetPagination):
+    ordering = ('id',)
+
+
+class OptionalKeysetPaginationMixin:
+    """Включает постраничный вывод по курсору keyset_pagination_class
+    для запросов с параметром pagination=cursor. Остальные запросы
+    обрабатываются обычным pagination_class."""
+
+    keyset_pagination_class = None
+
+    @property
+    def paginator(self):
+        if (not hasattr(self, '_paginator')
+                and self.keyset_pagination_class is not None
+                and self.request.query_params.get('pagination') == 'cursor'):
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
@@ -0,0 +1,240 @@
+import csv
+import io
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SHOPPING_LIST_TITLE = 'Список покупок:'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson. Ответ совпадает с ответом JSONRenderer:
+    дата и время, Decimal, ленивые строки перевода и прочие типы, которых
+    нет в JSON, передаются в default() того же encoder_class, ключи-числа
+    превращаются в строки, символы U+2028 и U+2029 экранируются.
+    Отступы (браузерный API, indent в Accept), ensure_ascii и значения,
+    с которыми orjson не справляется (например, слишком большие целые),
+    обрабатываются стандартным JSONRenderer. Без orjson класс целиком
+    работает как JSONRenderer. В отличие от него NaN и бесконечность
+    отдаются как null, а не вызывают ошибку."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii
+                or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=(orjson.OPT_NON_STR_KEYS
+                        | orjson.OPT_PASSTHROUGH_DATETIME),
+            )
+        except orjson.JSONEncodeError:
+            return super().render(
+                data, accepted_media_type, renderer_context)
+        return (ret.replace('\u2028'.encode(), b'\\u2028')
+                .replace('\u2029'.encode(), b'\\u2029'))
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер списка покупок.
+    Строки списка приходят из итератора словарей с ключами name,
+    measurement_unit и total_amount. Метод stream отдает результат по частям,
+    поэтому список не собирается в памяти целиком и может передаваться
+    клиенту через StreamingHttpResponse по мере чтения из базы."""
+
+    filename = 'shopping_cart'
+
+    def stream(self, rows):
+        raise NotImplementedError('Метод stream() должен быть определен')
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответ с ошибкой (например, 401) отдается обычным текстом.
+            return '\n'.join(
+                f'{key}: {value}' for key, value in data.items()
+            ).encode('utf-8')
+        chunks = self.stream(data or ())
+        if self.charset is None:
+            return b''.join(chunks)
+        return ''.join(chunks).encode(self.charset)
+
+    def get_filename(self):
+        return f'{self.filename}.{self.format}'
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        yield f'{SHOPPING_LIST_TITLE}\n'
+        for row in rows:
+            yield (f'{row["name"]}({row["measurement_unit"]}) - '
+                   f'{row["total_amount"]}\n')
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        # BOM нужен, чтобы Excel распознал кириллицу в UTF-8.
+        buffer.write('\ufeff')
+        writer.writerow(('Ингредиент', 'Единица измерения', 'Количество'))
+        for row in rows:
+            writer.writerow(
+                (row['name'], row['measurement_unit'], row['total_amount']))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        yield buffer.getvalue()
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    """Список покупок в PDF без сторонних библиотек.
+    Документ пишется последовательно: каждая страница отдается клиенту,
+    как только набрано нужное число строк, а дерево страниц и таблица
+    перекрестных ссылок дописываются в конце файла. Кириллица выводится
+    стандартным шрифтом Helvetica в кодировке cp1251 через /Differences,
+    поэтому встраивать файл шрифта не требуется."""
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    render_style = 'binary'
+
+    page_width = 595
+    page_height = 842
+    margin = 50
+    font_size = 12
+    title_font_size = 16
+    leading = 16
+
+    # Номера служебных объектов документа: каталог, дерево страниц, шрифт.
+    catalog_id = 1
+    pages_id = 2
+    font_id = 3
+    first_page_id = 4
+
+    def stream(self, rows):
+        writer = _PDFWriter()
+        yield writer.header()
+        yield writer.add_object(
+            self.catalog_id,
+            f'<< /Type /Catalog /Pages {self.pages_id} 0 R >>')
+        yield writer.add_object(self.font_id, self._font())
+
+        page_ids = []
+        lines = [(SHOPPING_LIST_TITLE, self.title_font_size)]
+        for row in rows:
+            lines.append((
+                f'{row["name"]} ({row["measurement_unit"]}) - '
+                f'{row["total_amount"]}',
+                self.font_size
+            ))
+            if len(lines) == self.lines_per_page:
+                yield from self._page(writer, page_ids, lines)
+                lines = []
+        if lines or not page_ids:
+            yield from self._page(writer, page_ids, lines)
+
+        kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+        yield writer.add_object(
+            self.pages_id,
+            f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>')
+        yield writer.trailer(self.catalog_id)
+
+    @property
+    def lines_per_page(self):
+        return (self.page_height - 2 * self.margin) // self.leading
+
+    def _page(self, writer, page_ids, lines):
+        content_id = self.first_page_id + 2 * len(page_ids)
+        page_id = content_id + 1
+        page_ids.append(page_id)
+
+        commands = [
+            'BT',
+            f'{self.leading} TL',
+            f'{self.margin} {self.page_height - self.margin} Td',
+        ]
+        for text, size in lines:
+            commands.append(f'/F1 {size} Tf')
+            commands.append(f'({_escape(text)}) Tj T*')
+        commands.append('ET')
+        content = '\n'.join(commands).encode('cp1251', errors='replace')
+
+        yield writer.add_stream(content_id, content)
+        yield writer.add_object(
+            page_id,
+            f'<< /Type /Page /Parent {self.pages_id} 0 R '
+            f'/MediaBox [0 0 {self.page_width} {self.page_height}] '
+            f'/Resources << /Font << /F1 {self.font_id} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>')
+
+    @staticmethod
+    def _font():
+        # Буквы А-я в cp1251 занимают коды 192-255 подряд, а в списке имен
+        # глифов Adobe между Е и Ж (е и ж) стоит Ё (ё), которая в cp1251
+        # вынесена на коды 168 и 184.
+        glyphs = ' '.join(
+            f'/afii{first + i + (i >= 6)}'
+            for first in (10017, 10065) for i in range(32))
+        return ('<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                '/Encoding << /Type /Encoding '
+                '/BaseEncoding /WinAnsiEncoding '
+                f'/Differences [168 /afii10023 184 /afii10071 '
+                f'192 {glyphs}] >> >>')
+
+
+def _escape(text):
+    return (text.replace('\\', '\\\\')
+            .replace('(', '\\(')
+            .replace(')', '\\)'))
+
+
+class _PDFWriter:
+    """Следит за смещениями объектов в потоке для таблицы xref."""
+
+    def __init__(self):
+        self.position = 0
+        self.offsets = {}
+
+    def _write(self, data):
+        self.position += len(data)
+        return data
+
+    def header(self):
+        return self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def add_object(self, object_id, body):
+        self.offsets[object_id] = self.position
+        return self._write(
+            f'{object_id} 0 obj\n{body}\nendobj\n'.encode('cp1251'))
+
+    def add_stream(self, object_id, content):
+        self.offsets[object_id] = self.position
+        return self._write(
+            f'{object_id} 0 obj\n<< /Length {len(content)} >>\nstream\n'
+            .encode('cp1251')
+            + content
+            + b'\nendstream\nendobj\n')
+
+    def trailer(self, root_id):
+        size = max(self.offsets) + 1
+        xref = [f'xref\n0 {size}\n', '0000000000 65535 f \n']
+        for object_id in range(1, size):
+            xref.append(f'{self.offsets[object_id]:010d} 00000 n \n')
+        xref.append(f'trailer\n<< /Size {size} /Root {root_id} 0 R >>\n'
+                    f'startxref\n{self.position}\n%%EOF\n')
+        return self._write(''.join(xref).encode('cp1251'))
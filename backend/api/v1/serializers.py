@@ -1,23 +1,36 @@
+import hashlib
 import logging
+from collections import defaultdict
 
+from api.profiling import ProfiledSerializerMixin, profile_section
+from django.conf import settings
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.cache import recipe_cache
+from recipes.cart import change_recipe_in_carts
+from recipes.counters import change_counter
+from recipes.images import schedule_image_processing
+from recipes.models import (BulkIngredientRecipe, CartIngredient, Ingredient,
+                            IngredientRecipe, Recipe, Tag)
 from rest_framework import serializers, status
 from users.models import User
 from users.serializers import CustomUserSerializer
 
+from .fields import DeferredBase64ImageField
+
 logger = logging.getLogger(__name__)
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(ProfiledSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug', )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(ProfiledSerializerMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = Ingredient
@@ -45,7 +58,21 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount',)
 
 
-class GetRecipeSerializer(serializers.ModelSerializer):
+class CartIngredientSerializer(ProfiledSerializerMixin,
+                               serializers.ModelSerializer):
+    """Сериализатор строки сводного списка покупок"""
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
+
+    class Meta:
+        model = CartIngredient
+        fields = ('id', 'name', 'measurement_unit', 'amount',)
+
+
+class GetRecipeSerializer(ProfiledSerializerMixin,
+                          serializers.ModelSerializer):
     """Сериализер для представления json в формате отвечающем документации"""
     author = CustomUserSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
@@ -57,14 +84,19 @@ class GetRecipeSerializer(serializers.ModelSerializer):
     @staticmethod
     def get_ingredients(obj):
         """Метод получения ингредиентов для рецепта из связанной таблицы.
+        Если ингредиенты подгружены во viewset через Prefetch, то новые
+        запросы в базу не выполняются.
         Т.к. self не используется, ставится декоратор @staticmethod"""
-        ingredients = IngredientRecipe.objects.filter(recipe=obj)
+        ingredients = obj.ingredientrecipe_set.all()
         return IngredientInRecipeSerializer(ingredients, many=True).data
 
     def get_is_favorited(self, obj):
         """Метод получения статуса избранного у пользователя.
         Если пользователь не авторизован, то отдается False
-        Для авторизованного пользователя рецепт в избранном True, нет False."""
+        Для авторизованного пользователя рецепт в избранном True, нет False.
+        Если queryset уже аннотирован флагом, то он берется из аннотации."""
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context['request']
         return (request.user.is_authenticated
                 and obj.favorite.filter(user=request.user).exists())
@@ -72,7 +104,10 @@ class GetRecipeSerializer(serializers.ModelSerializer):
     def get_is_in_shopping_cart(self, obj):
         """Метод получения статуса нахождения в корзине у пользователя
         Если пользователь не авторизован, то отдается False
-        Для авторизованного пользователя рецепт в корзине True, нет False."""
+        Для авторизованного пользователя рецепт в корзине True, нет False.
+        Если queryset уже аннотирован флагом, то он берется из аннотации."""
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context['request']
         return (request.user.is_authenticated
                 and obj.shoppingcart.filter(user=request.user).exists())
@@ -88,67 +123,253 @@ class GetRecipeSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'thumbnail',
             'text',
             'cooking_time',
         )
 
 
-class WriteRecipeSerializer(serializers.ModelSerializer):
+def file_url(file, request=None):
+    """Ссылка на файл в том же виде, в каком ее отдает FileField
+    сериализатора: абсолютная при наличии request, иначе от MEDIA_URL."""
+    if not file:
+        return None
+    url = file.storage.url(file.name)
+    if request is None:
+        return url
+    return request.build_absolute_uri(url)
+
+
+def short_recipe_data(recipe, request=None):
+    """То же, что ShortRecipeSerializer(recipe).data, без полей DRF."""
+    return {
+        'id': recipe.id,
+        'name': recipe.name,
+        'image': file_url(recipe.image, request),
+        'thumbnail': file_url(recipe.thumbnail, request),
+        'cooking_time': recipe.cooking_time,
+    }
+
+
+def recipe_data(recipes, request):
+    """То же, что GetRecipeSerializer(recipes, many=True).data для
+    рецептов без флагов пользователя (все флаги False), но без полей DRF
+    и экземпляров моделей: теги, ингредиенты и авторы читаются через
+    values_list() тремя запросами на всю пачку. Порядок тегов и
+    ингредиентов совпадает с порядком при prefetch_related."""
+    if not recipes:
+        return []
+    recipe_ids = [recipe.id for recipe in recipes]
+    tags = defaultdict(list)
+    for recipe_id, *tag in Recipe.tags.through.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list(
+        'recipe_id', 'tag__id', 'tag__name', 'tag__color', 'tag__slug'
+    ).order_by('tag__name', 'tag__id'):
+        tags[recipe_id].append(dict(zip(('id', 'name', 'color', 'slug'),
+                                        tag)))
+    ingredients = defaultdict(list)
+    for recipe_id, *ingredient in IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list(
+        'recipe_id', 'ingredient__id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    ).order_by('id'):
+        ingredients[recipe_id].append(dict(zip(
+            ('id', 'name', 'measurement_unit', 'amount'), ingredient)))
+    authors = {
+        author['id']: author
+        for author in User.objects.filter(
+            id__in={recipe.author_id for recipe in recipes}
+        ).values('email', 'id', 'username', 'first_name', 'last_name')
+    }
+    with profile_section('serializer'):
+        return [
+            {
+                'id': recipe.id,
+                'tags': tags[recipe.id],
+                'author': dict(authors[recipe.author_id],
+                               is_subscribed=False),
+                'ingredients': ingredients[recipe.id],
+                'is_favorited': False,
+                'is_in_shopping_cart': False,
+                'name': recipe.name,
+                'image': file_url(recipe.image, request),
+                'thumbnail': file_url(recipe.thumbnail, request),
+                'text': recipe.text,
+                'cooking_time': recipe.cooking_time,
+            }
+            for recipe in recipes
+        ]
+
+
+def recipe_representations(recipes, context):
+    """Представления рецептов в формате GetRecipeSerializer.
+    Общая для всех пользователей часть берется из recipe_cache, а для
+    рецептов, которых в кеше нет, строится recipe_data(). Флаги текущего
+    пользователя накладываются поверх из аннотаций is_favorited,
+    is_in_shopping_cart и author_is_subscribed, посчитанных в запросе
+    страницы. Абсолютные ссылки на изображения зависят от адреса сайта,
+    поэтому он входит в ключ кеша."""
+    request = context['request']
+    site = hashlib.md5(
+        request.build_absolute_uri('/').encode()).hexdigest()
+    public = recipe_cache.get_many(
+        recipes, lambda missing: recipe_data(missing, request), prefix=site)
+    representations = []
+    for recipe in recipes:
+        item = public[recipe.id].copy()
+        item['author'] = item['author'].copy()
+        item['author']['is_subscribed'] = recipe.author_is_subscribed
+        item['is_favorited'] = recipe.is_favorited
+        item['is_in_shopping_cart'] = recipe.is_in_shopping_cart
+        representations.append(item)
+    return representations
+
+
+def subscription_data(authors, recipes):
+    """То же, что SubscribeSerializer(authors, many=True).data без полей
+    DRF: рецепты всех авторов страницы читаются одним запросом values()
+    из recipes, уже ограниченного recipes_limit. Как и в
+    SubscribeSerializer, ссылки на изображения относительные."""
+    author_recipes = defaultdict(list)
+    for recipe in recipes.filter(author__in=authors).values(
+            'author_id', 'id', 'name', 'image', 'thumbnail', 'cooking_time'):
+        author_recipes[recipe.pop('author_id')].append(recipe)
+    storages = {field: Recipe._meta.get_field(field).storage
+                for field in ('image', 'thumbnail')}
+    with profile_section('serializer'):
+        for items in author_recipes.values():
+            for recipe in items:
+                for field, storage in storages.items():
+                    recipe[field] = (storage.url(recipe[field])
+                                     if recipe[field] else None)
+        return [
+            {
+                'email': author.email,
+                'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': author.is_subscribed,
+                'recipes': author_recipes[author.id],
+                'recipes_count': author.recipes_count,
+            }
+            for author in authors
+        ]
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления в избранное или
+    корзину и удаления из них."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
+
+
+class IngredientsOnHandSerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.INGREDIENTS_ON_HAND_LIMIT,
+    )
+    missing = serializers.IntegerField(min_value=0, default=0)
+
+
+class AddIngredientSerializer(serializers.Serializer):
+    """Ингредиент в запросе на создание или изменение рецепта.
+    Существование ингредиента проверяется пачкой в
+    WriteRecipeSerializer.validate_ingredients."""
+    id = serializers.IntegerField()
+    # Верхняя граница PositiveIntegerField на PostgreSQL: большее
+    # количество база отклонит ошибкой, а не ответом 400.
+    amount = serializers.IntegerField(max_value=2147483647)
+
+
+class WriteRecipeSerializer(ProfiledSerializerMixin,
+                            serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
-    ingredients = IngredientInRecipeSerializer(many=True)
-    image = Base64ImageField()
+    tags = serializers.ListField(child=serializers.IntegerField())
+    ingredients = AddIngredientSerializer(many=True)
+    image = DeferredBase64ImageField()
 
-    def validate(self, data):
-        """Валидация данных от клиента"""
-        if not data.get('tags'):
+    @staticmethod
+    def validate_tags(tags):
+        """Валидация поля tags.
+        Все теги загружаются одним запросом in_bulk: кеш справочника
+        служит только для чтения, тег мог быть удален в другом процессе.
+        Ошибки собираются по всем тегам сразу и возвращаются с индексом
+        тега в запросе."""
+        if not tags:
             raise serializers.ValidationError('Поле tags отсутствует')
-        tag_list = []
-        for tag in data.get('tags'):
-            if not Tag.objects.filter(name=tag).exists():
-                raise serializers.ValidationError(
-                    f'Тега с названием {tag} не существует в базе данных'
-                )
-            if tag in tag_list:
-                raise serializers.ValidationError(
-                    'Вы не можете указывать два и более одинаковых тега'
-                )
-            tag_list.append(tag)
-        return data
+        tag_ids = Tag.objects.in_bulk(set(tags))
+        errors = {}
+        tag_list = set()
+        for index, tag_id in enumerate(tags):
+            if tag_id not in tag_ids:
+                errors[index] = [
+                    f'Тега с id={tag_id} не существует в базе данных']
+            elif tag_id in tag_list:
+                errors[index] = [
+                    'Вы не можете указывать два и более одинаковых тега']
+            tag_list.add(tag_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return tags
 
     @staticmethod
     def validate_ingredients(ingredients):
-        """Валидация поля Ingredients"""
+        """Валидация поля ingredients.
+        Все ингредиенты загружаются одним запросом in_bulk, повторы и
+        неверное количество проверяются за один проход. Ошибки собираются
+        по всем ингредиентам сразу и возвращаются с индексом ингредиента
+        в запросе."""
         if not ingredients:
             raise serializers.ValidationError('Поле ingredients отсутствует')
 
-        ingredient_list = []
-        for ingredient_dict in ingredients:
-            ingredient_id = ingredient_dict.get('ingredient').id
-            ingredient_amount = ingredient_dict.get('amount')
-
-            if not ingredient_id:
-                raise serializers.ValidationError(
-                    'id ингредиент не указан')
-            if not Ingredient.objects.filter(id=ingredient_id).exists():
-                raise serializers.ValidationError(
-                    f'Ингредиента с id={ingredient_id} нет в базе данных')
-            if ingredient_id in ingredient_list:
-                raise serializers.ValidationError(
-                    'Ингредиенты в одном рецепте не могут повторяться')
-
-            if not ingredient_amount:
-                raise serializers.ValidationError(
-                    'Поле amount ингредиента отсутствует')
-            if int(ingredient_amount) <= 0:
-                raise serializers.ValidationError(
-                    'Количество ингредиентов должно быть больше 0')
-            ingredient_list.append(ingredient_id)
-
-        return ingredients
+        found = Ingredient.objects.in_bulk(
+            {ingredient['id'] for ingredient in ingredients})
+        errors = {}
+        ingredient_list = set()
+        for index, ingredient in enumerate(ingredients):
+            ingredient_id = ingredient['id']
+            ingredient_errors = {}
+            if ingredient_id not in found:
+                ingredient_errors['id'] = [
+                    f'Ингредиента с id={ingredient_id} нет в базе данных']
+            elif ingredient_id in ingredient_list:
+                ingredient_errors['id'] = [
+                    'Ингредиенты в одном рецепте не могут повторяться']
+            if ingredient['amount'] <= 0:
+                ingredient_errors['amount'] = [
+                    'Количество ингредиентов должно быть больше 0']
+            if ingredient_errors:
+                errors[index] = ingredient_errors
+            ingredient_list.add(ingredient_id)
+        if errors:
+            raise serializers.ValidationError(errors)
+
+        return [
+            {'ingredient': found[ingredient['id']],
+             'amount': ingredient['amount']}
+            for ingredient in ingredients
+        ]
 
     def to_representation(self, instance):
         """Метод переопределяет сериализер для отображения в соответствии с
-        документацией после успешного POST запроса по коду 201"""
+        документацией после успешного POST запроса по коду 201.
+        Теги и ингредиенты подгружаются пачкой, чтобы число запросов не
+        зависело от количества ингредиентов."""
+        prefetch_related_objects(
+            [instance],
+            'tags',
+            Prefetch('ingredientrecipe_set',
+                     queryset=IngredientRecipe.objects.select_related(
+                         'ingredient')),
+        )
         return GetRecipeSerializer(
             instance=instance, context=self.context).data
 
@@ -178,30 +399,83 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
 
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            **validated_data, ingredients_count=len(ingredients))
         recipe.tags.set(tags)
         self.add_ingredients(recipe, ingredients)
+        schedule_image_processing(recipe.id)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """Приводит ингредиенты рецепта к переданному списку, сравнивая его
+        с тем, что уже хранится в базе: новые ингредиенты добавляются,
+        у оставшихся меняется только количество, лишние удаляются.
+        Неизменные строки связанной таблицы не трогаются.
+        Строки пишутся и удаляются пачкой в обход сигналов, поэтому счетчик
+        ингредиентов меняется здесь же одним запросом, а разница количеств
+        одним вызовом переносится в списки покупок пользователей, у которых
+        рецепт лежит в корзине. Поисковый вектор пересчитывает сигнал
+        recipe_saved после фиксации транзакции."""
+        current = {
+            ingredient_recipe.ingredient_id: ingredient_recipe
+            for ingredient_recipe in IngredientRecipe.objects.filter(
+                recipe=recipe)
+        }
+        to_create = []
+        to_update = []
+        deltas = {}
+        for ingredient_dict in ingredients:
+            ingredient = ingredient_dict['ingredient']
+            amount = ingredient_dict['amount']
+            ingredient_recipe = current.pop(ingredient.id, None)
+            if ingredient_recipe is None:
+                to_create.append(IngredientRecipe(
+                    ingredient=ingredient, amount=amount, recipe=recipe))
+                deltas[ingredient.id] = amount
+            elif ingredient_recipe.amount != amount:
+                deltas[ingredient.id] = amount - ingredient_recipe.amount
+                ingredient_recipe.amount = amount
+                to_update.append(ingredient_recipe)
+
+        for ingredient_id, ingredient_recipe in current.items():
+            deltas[ingredient_id] = -ingredient_recipe.amount
+
+        if current:
+            BulkIngredientRecipe.objects.filter(
+                id__in=[item.id for item in current.values()]).delete()
+        if to_update:
+            IngredientRecipe.objects.bulk_update(to_update, ('amount',))
+        if to_create:
+            IngredientRecipe.objects.bulk_create(to_create)
+        if len(to_create) != len(current):
+            change_counter(Recipe, recipe.id, 'ingredients_count',
+                           len(to_create) - len(current))
+        if deltas:
+            change_recipe_in_carts(recipe.id, deltas)
+
     @transaction.atomic
     def update(self, instance, validated_data):
         """В instance находится экземпляр класса Recipe из базы данных.
         В validated_data данные на которые нужно заменить.
-        1. Вытаскиваю ingredients и tags из validated_data.
-        2. Обновляю данные instance на validate_data
-        3. Очищаю поле ingredients и tags в instance
-        4. Сохраняю рецепт
-        5. Вставляю tags
-        6. Вставляю ингредиенты"""
-
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
+        1. Вытаскиваю ingredients и tags из validated_data. При PATCH
+        запросе их может не быть, тогда они остаются без изменений.
+        2. Обновляю и сохраняю поля instance из validated_data
+        3. Обновляю tags: set() сам добавляет и удаляет только разницу
+        4. Обновляю ингредиенты по разнице с сохраненными
+        При замене изображения старая миниатюра сбрасывается, а новая
+        строится в фоне."""
+
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if 'image' in validated_data:
+            validated_data['thumbnail'] = None
+            schedule_image_processing(instance.id)
         instance = super().update(instance, validated_data)
-        instance.ingredients.clear()
-        instance.tags.clear()
-        instance.save()
-        instance.tags.set(tags)
-        self.add_ingredients(instance, ingredients)
+        if tags is not None:
+            instance.tags.set(tags)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
         return instance
 
     class Meta:
@@ -218,10 +492,11 @@ class WriteRecipeSerializer(serializers.ModelSerializer):
         )
 
 
-class ShortRecipeSerializer(serializers.ModelSerializer):
+class ShortRecipeSerializer(ProfiledSerializerMixin,
+                            serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
+        fields = ('id', 'name', 'image', 'thumbnail', 'cooking_time',)
 
 
 class SubscribeSerializer(CustomUserSerializer):
@@ -243,16 +518,20 @@ class SubscribeSerializer(CustomUserSerializer):
             )
         return data
 
-    @staticmethod
-    def get_recipes(obj):
-        recipes = Recipe.objects.filter(author=obj)
+    def get_recipes(self, obj):
+        """Рецепты автора, не больше recipes_limit из контекста.
+        Если рецепты подгружены во viewset через Prefetch, то новых
+        запросов в базу не выполняется."""
+        recipes = obj.recipes.all()
+        recipes_limit = self.context.get('recipes_limit')
+        if recipes_limit:
+            recipes = recipes[:recipes_limit]
         serializer = ShortRecipeSerializer(recipes, many=True)
         return serializer.data
 
     @staticmethod
     def get_recipes_count(obj):
-        recipes = Recipe.objects.filter(author=obj)
-        return recipes.count()
+        return obj.recipes_count
 
     class Meta:
         model = User
@@ -1,43 +1,255 @@
+import hashlib
+
 from api.permissions import AuthorOrReadOnly
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Value,
+                              Window)
+from django.http import StreamingHttpResponse
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.http import http_date
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.cache import ingredient_cache, tag_cache
+from recipes.models import (CartIngredient, Favorite, Ingredient, Recipe,
+                            ShoppingCart, Tag, TimelineEntry)
+from recipes.recommendations import recommended_recipe_ids
+from recipes.search import match_recipes
+from recipes.timeline import uses_inbox
+from recipes.user_recipes import add_user_recipes, remove_user_recipes
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from users.models import Subscribe, User
 
 from .filters import IngredientFilter, RecipeFilter
-from .pagination import LimitPagination
-from .serializers import (GetRecipeSerializer, IngredientSerializer,
-                          ShortRecipeSerializer, TagSerializer,
-                          WriteRecipeSerializer)
+from .pagination import (LimitPagination, OptionalKeysetPaginationMixin,
+                         RecipeKeysetPagination, TimelineKeysetPagination)
+from .renderers import (ShoppingListCSVRenderer, ShoppingListPDFRenderer,
+                        ShoppingListTextRenderer)
+from .serializers import (CartIngredientSerializer, GetRecipeSerializer,
+                          IngredientSerializer, IngredientsOnHandSerializer,
+                          RecipeIdsSerializer, TagSerializer,
+                          WriteRecipeSerializer, recipe_representations,
+                          short_recipe_data)
+
+
+class ReferenceDataCacheMixin:
+    """Отдает справочники из кеша reference_cache без обращения к базе и
+    повторной сериализации. Ответы снабжаются заголовками ETag и
+    Last-Modified, так что повторный запрос клиента с If-None-Match или
+    If-Modified-Since получает 304."""
+
+    reference_cache = None
+
+    def list(self, request, *args, **kwargs):
+        params = sorted(request.query_params.lists())
+        build = super().list
+        return self.cached_response(
+            request, f'list:{params}',
+            lambda: build(request, *args, **kwargs).data)
 
+    def retrieve(self, request, *args, **kwargs):
+        build = super().retrieve
+        return self.cached_response(
+            request, f'retrieve:{kwargs[self.lookup_field]}',
+            lambda: build(request, *args, **kwargs).data)
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+    def cached_response(self, request, key, build):
+        key = hashlib.md5(key.encode()).hexdigest()
+        version, data = self.reference_cache.get_or_set(key, build)
+        response = Response(data)
+        response['ETag'] = quote_etag(f'{version}:{key}')
+        response['Last-Modified'] = http_date(version)
+        return get_conditional_response(
+            request,
+            etag=response['ETag'],
+            last_modified=int(version),
+            response=response,
+        )
+
+
+class TagViewSet(ReferenceDataCacheMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    reference_cache = tag_cache
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceDataCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend, )
     filterset_class = IngredientFilter
     pagination_class = None
+    reference_cache = ingredient_cache
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(OptionalKeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = GetRecipeSerializer
     permission_classes = AuthorOrReadOnly,
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
     pagination_class = LimitPagination
+    keyset_pagination_class = RecipeKeysetPagination
+
+    def get_queryset(self):
+        """Метод собирает queryset рецептов так, чтобы страница списка
+        отдавалась за фиксированное число запросов: флаги избранного,
+        корзины и подписки на автора вычисляются подзапросами Exists()
+        в основном запросе. Теги и ингредиенты для чтения не подгружаются:
+        представления рецептов берутся из кеша (recipe_representations)."""
+        user = self.request.user
+        # Поисковый вектор нужен только в WHERE и ORDER BY.
+        recipes = Recipe.objects.defer('search_vector')
+        if user.is_anonymous:
+            queryset = recipes.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+            is_subscribed = Value(False)
+        else:
+            queryset = recipes.annotate(
+                is_favorited=Exists(Favorite.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                    user=user, recipe=OuterRef('pk'))),
+                author_is_subscribed=Exists(Subscribe.objects.filter(
+                    user=user, author=OuterRef('author'))),
+            )
+            is_subscribed = Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('pk')))
+        if self.action in ('list', 'retrieve', 'cookable', 'similar',
+                           'recommended', 'timeline'):
+            return queryset
+        # Ответ на запись строит WriteRecipeSerializer с полным автором.
+        return queryset.prefetch_related(Prefetch(
+            'author',
+            queryset=User.objects.annotate(is_subscribed=is_subscribed)))
+
+    def recipe_state(self):
+        """Поля, от которых зависит представление рецепта для текущего
+        пользователя: время изменения рецепта и флаги избранного, корзины
+        и подписки на автора. Читаются одним запросом без подгрузки
+        связанных объектов."""
+        return self.filter_queryset(self.get_queryset()).values(
+            'id', 'updated_at', 'is_favorited', 'is_in_shopping_cart',
+            'author_is_subscribed')
+
+    @staticmethod
+    def state_of(recipe, total=None):
+        return {
+            'id': recipe.id,
+            'updated_at': recipe.updated_at,
+            'is_favorited': recipe.is_favorited,
+            'is_in_shopping_cart': recipe.is_in_shopping_cart,
+            'author_is_subscribed': recipe.author_is_subscribed,
+            'total': total,
+        }
+
+    @staticmethod
+    def state_etag(rows):
+        """ETag по состоянию рецептов. Учитывает также версии справочников
+        тегов и ингредиентов, которые входят в представление рецепта."""
+        state = ';'.join(
+            f'{row["id"]}:{row["updated_at"].isoformat()}:'
+            f'{row["is_favorited"]:d}{row["is_in_shopping_cart"]:d}'
+            f'{row["author_is_subscribed"]:d}:{row.get("total")}'
+            for row in rows
+        )
+        return quote_etag(hashlib.md5(
+            f'{tag_cache.version()}:{ingredient_cache.version()}:{state}'
+            .encode()).hexdigest())
+
+    @staticmethod
+    def is_conditional(request):
+        return ('HTTP_IF_NONE_MATCH' in request.META
+                or 'HTTP_IF_MODIFIED_SINCE' in request.META)
+
+    @staticmethod
+    def set_validators(response, etag, last_modified=None):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # Флаги в ответе зависят от пользователя.
+        patch_vary_headers(response, ('Authorization', ))
+        return response
+
+    def page_state(self, request):
+        """Состояние рецептов запрошенной страницы списка и их общее
+        количество (оконной функцией в том же запросе). Для курсорной
+        пагинации и некорректного номера страницы возвращает None."""
+        paginator = self.paginator
+        if not isinstance(paginator, LimitPagination):
+            return None
+        page_size = paginator.get_page_size(request)
+        try:
+            page = int(request.query_params.get(
+                paginator.page_query_param, 1))
+        except ValueError:
+            return None
+        if page < 1:
+            return None
+        offset = (page - 1) * page_size
+        rows = list(self.recipe_state().annotate(
+            total=Window(Count('id')))[offset:offset + page_size])
+        if not rows and page > 1:
+            return None
+        return rows
+
+    def list(self, request, *args, **kwargs):
+        """Повторный запрос страницы с If-None-Match стоит одного запроса
+        к базе: если состояние рецептов страницы не изменилось, ответ 304
+        отдается без сериализации."""
+        if self.is_conditional(request):
+            rows = self.page_state(request)
+            if rows is not None:
+                etag = self.state_etag(rows)
+                response = get_conditional_response(request, etag=etag)
+                if response is not None:
+                    return self.set_validators(response, etag)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(recipe_representations(
+                list(queryset), self.get_serializer_context()))
+        response = self.get_paginated_response(recipe_representations(
+            page, self.get_serializer_context()))
+        if isinstance(self.paginator, LimitPagination):
+            total = self.paginator.page.paginator.count
+            self.set_validators(response, self.state_etag(
+                self.state_of(recipe, total) for recipe in page))
+        return response
+
+    def retrieve(self, request, *args, **kwargs):
+        """Аналогично list() для одного рецепта. Last-Modified отдается
+        только анонимным пользователям: флаги избранного и корзины
+        меняются без изменения updated_at рецепта."""
+        anonymous = request.user.is_anonymous
+        if self.is_conditional(request):
+            try:
+                state = self.recipe_state().filter(
+                    pk=kwargs[self.lookup_field]).first()
+            except (TypeError, ValueError):
+                state = None
+            if state is not None:
+                etag = self.state_etag([state])
+                last_modified = (int(state['updated_at'].timestamp())
+                                 if anonymous else None)
+                response = get_conditional_response(
+                    request, etag=etag, last_modified=last_modified)
+                if response is not None:
+                    return self.set_validators(response, etag, last_modified)
+        recipe = self.get_object()
+        response = Response(recipe_representations(
+            [recipe], self.get_serializer_context())[0])
+        return self.set_validators(
+            response, self.state_etag([self.state_of(recipe)]),
+            int(recipe.updated_at.timestamp()) if anonymous else None)
 
     def perform_create(self, serializer):
         """Метод автоматически добавляет текущего пользователя в поле автора
@@ -58,18 +270,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipes/{id}/favorite/ и в зависимости от типа запроса POST или DELETE
         добавляет, или удаляет запись об авторе и рецепте в таблице
         избранного"""
-        recipe = get_object_or_404(Recipe, pk=pk)
-        if request.method == 'POST':
-            serializer = ShortRecipeSerializer(recipe)
-            Favorite.objects.create(recipe=recipe, user=request.user)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-        favorite_recipe = Favorite.objects.filter(
-            user=request.user, recipe=recipe)
-        favorite_recipe.delete()
-        return Response(f'Рецепт ({recipe.name}) удален из избранного '
-                        f'пользователя ({request.user.username})',
-                        status=status.HTTP_204_NO_CONTENT)
+        return self.change_user_recipe(request, pk, Favorite, 'избранного')
 
     @action(methods=['post', 'delete'], detail=True)
     def shopping_cart(self, request, pk):
@@ -77,35 +278,190 @@ class RecipeViewSet(viewsets.ModelViewSet):
         recipes/{id}/shopping_cart/ и в зависимости от типа запроса
         POST или DELETE добавляет, или удаляет запись об авторе и рецепте в
         таблице корзины"""
+        return self.change_user_recipe(request, pk, ShoppingCart, 'корзины')
+
+    @staticmethod
+    def change_user_recipe(request, pk, model, place):
+        """Запросы идемпотентны: повторное добавление рецепта отвечает
+        200 вместо 201, удаление отсутствующего - тем же 204."""
         recipe = get_object_or_404(Recipe, pk=pk)
         if request.method == 'POST':
-            serializer = ShortRecipeSerializer(recipe)
-            ShoppingCart.objects.create(recipe=recipe, user=request.user)
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-        shoppingcart_recipe = ShoppingCart.objects.filter(
-            user=request.user, recipe=recipe)
-        shoppingcart_recipe.delete()
-        return Response(f'Рецепт ({recipe.name}) удален из корзины '
+            created = add_user_recipes(model, request.user.id, [recipe.id])
+            return Response(
+                short_recipe_data(recipe),
+                status=(status.HTTP_201_CREATED if created
+                        else status.HTTP_200_OK))
+        remove_user_recipes(model, request.user.id, [recipe.id])
+        return Response(f'Рецепт ({recipe.name}) удален из {place} '
                         f'пользователя ({request.user.username})',
                         status=status.HTTP_204_NO_CONTENT)
 
+    @action(methods=['post', 'delete'], detail=False, url_path='favorite',
+            url_name='favorite_many', permission_classes=(IsAuthenticated,))
+    def favorite_many(self, request):
+        """Добавляет в избранное или удаляет из него несколько рецептов,
+        см. change_user_recipes."""
+        return self.change_user_recipes(request, Favorite)
+
+    @action(methods=['get', 'post', 'delete'], detail=False,
+            url_path='shopping_cart', url_name='shopping_cart_many',
+            permission_classes=(IsAuthenticated,))
+    def shopping_cart_many(self, request):
+        """GET отдает список покупок в json (shopping_cart_preview),
+        POST и DELETE добавляют в корзину или удаляют из нее несколько
+        рецептов, см. change_user_recipes."""
+        if request.method == 'GET':
+            return self.shopping_cart_preview(request)
+        return self.change_user_recipes(request, ShoppingCart)
+
+    @staticmethod
+    def change_user_recipes(request, model):
+        """Пакетная версия change_user_recipe. Принимает {"recipes": [id]},
+        проверяет все id одним запросом и отвечает словарем id -> результат:
+        created или exists при добавлении, deleted или absent при удалении,
+        not_found для несуществующих рецептов."""
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        found = set(Recipe.objects.filter(
+            pk__in=recipe_ids).values_list('pk', flat=True))
+        if request.method == 'POST':
+            changed = add_user_recipes(model, request.user.id, found)
+            results = ('created', 'exists')
+        else:
+            changed = remove_user_recipes(model, request.user.id, found)
+            results = ('deleted', 'absent')
+        return Response({
+            str(pk): (results[pk not in changed] if pk in found
+                      else 'not_found')
+            for pk in recipe_ids
+        })
+
+    @action(methods=['get'], detail=False)
+    def cookable(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов:
+        ?ingredients=1&ingredients=2 - id ингредиентов, ?missing=k -
+        сколько ингредиентов можно докупить (по умолчанию 0, то есть
+        есть все). Сначала идут рецепты с меньшим числом недостающих
+        ингредиентов, в каждом рецепте добавлены поля
+        matched_ingredients и missing_ingredients."""
+        params = IngredientsOnHandSerializer(data={
+            'ingredients': request.query_params.getlist('ingredients'),
+            'missing': request.query_params.get('missing', 0),
+        })
+        params.is_valid(raise_exception=True)
+        # Курсорная пагинация по дате к этой сортировке не подходит.
+        paginator = LimitPagination()
+        rows = paginator.paginate_queryset(
+            match_recipes(params.validated_data['ingredients'],
+                          params.validated_data['missing']),
+            request, view=self)
+        recipes = self.get_queryset().in_bulk(
+            [row['recipe_id'] for row in rows])
+        rows = [row for row in rows if row['recipe_id'] in recipes]
+        data = recipe_representations(
+            [recipes[row['recipe_id']] for row in rows],
+            self.get_serializer_context())
+        for item, row in zip(data, rows):
+            item['matched_ingredients'] = row['matched']
+            item['missing_ingredients'] = row['missing']
+        return paginator.get_paginated_response(data)
+
+    @action(methods=['get'], detail=True)
+    def similar(self, request, pk):
+        """Похожие рецепты: те, что чаще добавляют в избранное и корзину
+        вместе с этим. Списки заранее считает команда
+        update_recommendations, ?limit= ограничивает их длину."""
+        neighbours = get_object_or_404(Recipe.objects.values_list(
+            'neighbours__recipes', flat=True), pk=pk)
+        return Response(self.representations_in_order(
+            (neighbours or [])[:self.recommendations_limit(request)]))
+
     @action(methods=['get'], detail=False,
             permission_classes=(IsAuthenticated,))
+    def recommended(self, request):
+        """Рецепты, рекомендованные пользователю по его избранному и
+        корзине, см. recommended_recipe_ids."""
+        return Response(self.representations_in_order(recommended_recipe_ids(
+            request.user.id, self.recommendations_limit(request))))
+
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,))
+    def timeline(self, request):
+        """Лента подписок: рецепты авторов, на которых подписан
+        пользователь, от новых к старым, с постраничным выводом по
+        курсору. При большом числе подписок лента читается из заранее
+        разложенной TimelineEntry, иначе запросом по авторам, см.
+        recipes.timeline."""
+        user = request.user
+        if not uses_inbox(user):
+            paginator = RecipeKeysetPagination()
+            page = paginator.paginate_queryset(
+                self.get_queryset().filter(
+                    author__in=Subscribe.objects.filter(
+                        user=user).values('author')),
+                request, view=self)
+            return paginator.get_paginated_response(recipe_representations(
+                page, self.get_serializer_context()))
+        paginator = TimelineKeysetPagination()
+        entries = paginator.paginate_queryset(
+            TimelineEntry.objects.filter(user=user).values(
+                'recipe_id', 'pub_date'),
+            request, view=self)
+        return paginator.get_paginated_response(
+            self.representations_in_order(
+                [entry['recipe_id'] for entry in entries]))
+
+    @staticmethod
+    def recommendations_limit(request):
+        limit = LimitPagination().get_page_size(request)
+        return min(limit, settings.RECOMMENDATIONS_NEIGHBOURS)
+
+    def representations_in_order(self, recipe_ids):
+        """Представления рецептов в порядке recipe_ids. Рецепты, удаленные
+        с момента расчета списка, пропускаются."""
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return recipe_representations(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            self.get_serializer_context())
+
+    @action(methods=['get'], detail=False,
+            permission_classes=(IsAuthenticated,),
+            renderer_classes=(ShoppingListTextRenderer,
+                              ShoppingListCSVRenderer,
+                              ShoppingListPDFRenderer))
     def download_shopping_cart(self, request):
-        ingredient_list = IngredientRecipe.objects.filter(
-            recipe__shoppingcart__user=request.user).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(sum_amount=Sum('amount'))
-        shopping_list = ['Список покупок:\n']
-        shopping_list += '\n'.join([
-            f'{ingredient["ingredient__name"]}'
-            f'({ingredient["ingredient__measurement_unit"]}) - '
-            f'{ingredient["sum_amount"]}'
-            for ingredient in ingredient_list
-        ])
-        filename = 'shopping_cart.txt'
-        response = HttpResponse(shopping_list, content_type='text/plain')
-        response[
-            'Content-Disposition'] = f'attachment; filename={filename}'
+        """Метод отдает список покупок в формате, выбранном параметром
+        ?format= (txt, csv или pdf, по умолчанию txt).
+        Список читается из заранее посчитанной таблицы CartIngredient
+        одним запросом по индексу пользователя. Строки читаются курсором
+        через iterator() и сразу пишутся в ответ, поэтому первые байты
+        уходят клиенту без ожидания сборки всего списка."""
+        renderer = request.accepted_renderer
+        ingredients = CartIngredient.objects.filter(
+            user=request.user
+        ).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+            total_amount=F('amount'),
+        ).order_by('name', 'measurement_unit').iterator()
+
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename={renderer.get_filename()}')
         return response
+
+    @staticmethod
+    def shopping_cart_preview(request):
+        """Метод отдает список покупок в json: те же строки, что и
+        download_shopping_cart, для просмотра в приложении."""
+        ingredients = CartIngredient.objects.filter(
+            user=request.user
+        ).select_related('ingredient').order_by(
+            'ingredient__name', 'ingredient__measurement_unit')
+        serializer = CartIngredientSerializer(ingredients, many=True)
+        return Response(serializer.data)
@@ -18,6 +18,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -53,6 +54,16 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    # orjson необязателен: без него используются стандартные JSON-классы.
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.v1.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.v1.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'PAGE_SIZE': 6,
 }
 
@@ -62,6 +73,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'api.profiling.RequestProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -97,6 +109,26 @@ DATABASES = {
     }
 }
 
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# locmem у каждого процесса свой: сброс версии справочника после
+# изменения виден только процессу, который его сделал. Поэтому с ним
+# записи и версии живут минуты, а не сутки. В docker-compose кеш общий
+# (Redis).
+LOCAL_CACHE = CACHE_BACKEND.endswith('.LocMemCache')
+REFERENCE_DATA_CACHE = 'default'
+REFERENCE_DATA_CACHE_TIMEOUT = 60 * 5 if LOCAL_CACHE else 60 * 60 * 24
+REFERENCE_DATA_VERSION_TIMEOUT = 60 * 5 if LOCAL_CACHE else None
+REFERENCE_DATA_LRU_SIZE = 1024
+RECIPE_CACHE_TIMEOUT = 60 * 5 if LOCAL_CACHE else 60 * 60 * 24
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -127,8 +159,44 @@ STATIC_ROOT = (BASE_DIR / 'static')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = (BASE_DIR / 'media')
 
+IMAGE_PROCESSING_ASYNC = True
+IMAGE_PROCESSING_WORKERS = 2
+RECIPE_THUMBNAIL_SIZE = 480
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+INGREDIENT_SEARCH_LIMIT = 20
+
+SUBSCRIPTION_RECIPES_LIMIT = 10
+
+# Сколько рецептов можно добавить в избранное или корзину одним запросом.
+BULK_RECIPES_LIMIT = 100
+
+# Сколько ингредиентов можно передать в поиск рецептов по продуктам.
+INGREDIENTS_ON_HAND_LIMIT = 100
+
+# Рекомендации, см. recipes.recommendations: сколько похожих рецептов
+# хранится для каждого рецепта, сколько последних рецептов пользователя
+# из избранного и корзины учитывается и сколько строк матрицы близости
+# считается за раз.
+RECOMMENDATIONS_NEIGHBOURS = 20
+RECOMMENDATIONS_HISTORY = 50
+RECOMMENDATIONS_BLOCK_SIZE = 500
+
+# С какого числа подписок лента пользователя раскладывается заранее
+# в TimelineEntry, а не выбирается запросом по авторам, см.
+# recipes.timeline. После изменения ленты пересобираются командой
+# rebuild_timelines.
+TIMELINE_INBOX_THRESHOLD = int(os.getenv('TIMELINE_INBOX_THRESHOLD', 200))
+
+# Доля запросов, для которых замеряется время и SQL (0 - только по
+# заголовку X-Request-Profile), см. api.profiling.
+REQUEST_PROFILING_SAMPLE_RATE = float(
+    os.getenv('REQUEST_PROFILING_SAMPLE_RATE', 0))
+REQUEST_PROFILING_SLOW_QUERY_MS = 100
+REQUEST_PROFILING_SLOW_QUERIES = 5
+REQUEST_PROFILING_REPEATED_QUERIES = 5
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 
 EMAIL_FILE_PATH = (BASE_DIR / 'sent_emails')
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from import_export.admin import ImportExportModelAdmin
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.models import (CartIngredient, Favorite, Ingredient,
+                            IngredientRecipe, Recipe, RecipeNeighbours,
+                            ShoppingCart, Tag, TimelineEntry)
 
 
 @admin.register(Tag)
@@ -27,6 +28,7 @@ class RecipeAdmin(admin.ModelAdmin):
                     'image',
                     'text',
                     'cooking_time',
+                    'favorites_count',
                     )
     search_fields = ('name', 'author', 'tags')
     list_filter = ('author', 'name', 'tags')
@@ -53,3 +55,24 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_filter = ('recipe', 'user')
     search_fields = ('user', )
     empty_value_display = '-пусто-'
+
+
+@admin.register(CartIngredient)
+class CartIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+    list_filter = ('user', )
+    empty_value_display = '-пусто-'
+
+
+@admin.register(RecipeNeighbours)
+class RecipeNeighboursAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'recipes', 'interactions', 'updated_at')
+    readonly_fields = ('recipe', 'recipes', 'scores', 'interactions')
+    empty_value_display = '-пусто-'
+
+
+@admin.register(TimelineEntry)
+class TimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe', 'author', 'pub_date')
+    list_filter = ('user', )
+    empty_value_display = '-пусто-'
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import InvalidCacheBackendError, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+_fallback_cache = LocMemCache('reference-data', {})
+
+
+def get_shared_cache():
+    """Общий для всех процессов кеш из настройки REFERENCE_DATA_CACHE.
+    Если такой бэкенд в CACHES не описан, используется locmem."""
+    try:
+        return caches[settings.REFERENCE_DATA_CACHE]
+    except InvalidCacheBackendError:
+        return _fallback_cache
+
+
+class ReferenceDataCache:
+    """Кеш редко меняющихся справочников (теги, ингредиенты).
+    Версия справочника хранится в общем кеше и равна времени последнего
+    изменения, она же служит для заголовков ETag и Last-Modified.
+    Значения сначала ищутся в LRU текущего процесса, затем в общем кеше.
+    Ключи включают версию, поэтому после invalidate() старые значения
+    просто перестают читаться и вытесняются сами. С кешем, который не
+    общий для процессов (locmem), версия живет
+    REFERENCE_DATA_VERSION_TIMEOUT, после чего процесс перечитывает
+    справочник."""
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+
+    @property
+    def _version_key(self):
+        return f'{self.namespace}:version'
+
+    def version(self):
+        cache = get_shared_cache()
+        version = cache.get(self._version_key)
+        if version is None:
+            cache.add(self._version_key, time.time(),
+                      timeout=settings.REFERENCE_DATA_VERSION_TIMEOUT)
+            version = cache.get(self._version_key)
+        return version
+
+    def invalidate(self):
+        get_shared_cache().set(
+            self._version_key, time.time(),
+            timeout=settings.REFERENCE_DATA_VERSION_TIMEOUT)
+        with self._lock:
+            self._local.clear()
+
+    def get_or_set(self, key, default):
+        """Возвращает пару (версия, значение). Если значения нет ни в
+        одном из кешей, оно вычисляется вызовом default()."""
+        version = self.version()
+        versioned_key = f'{self.namespace}:{version}:{key}'
+        with self._lock:
+            if versioned_key in self._local:
+                self._local.move_to_end(versioned_key)
+                return version, self._local[versioned_key]
+
+        cache = get_shared_cache()
+        value = cache.get(versioned_key)
+        if value is None:
+            value = default()
+            cache.set(versioned_key, value,
+                      timeout=settings.REFERENCE_DATA_CACHE_TIMEOUT)
+
+        with self._lock:
+            self._local[versioned_key] = value
+            while len(self._local) > settings.REFERENCE_DATA_LRU_SIZE:
+                self._local.popitem(last=False)
+        return version, value
+
+
+tag_cache = ReferenceDataCache('tags')
+ingredient_cache = ReferenceDataCache('ingredients')
+
+
+class RecipeRepresentationCache:
+    """Кеш не зависящей от пользователя части представления рецептов.
+    Ключ включает id рецепта, время его изменения и версии справочников
+    тегов и ингредиентов. Поэтому изменение рецепта (в том числе его
+    ингредиентов, тегов и изображения), тега, ингредиента или профиля
+    автора (см. signals.author_changed) делает старую запись недоступной
+    без явного удаления."""
+
+    namespace = 'recipe'
+
+    def keys(self, recipes, prefix):
+        versions = f'{tag_cache.version()}:{ingredient_cache.version()}'
+        return {
+            recipe.id: (f'{self.namespace}:{prefix}:{recipe.id}:'
+                        f'{recipe.updated_at.timestamp()}:{versions}')
+            for recipe in recipes
+        }
+
+    def get_many(self, recipes, build, prefix=''):
+        """Возвращает словарь id рецепта -> представление. Одно чтение
+        из кеша на все рецепты, отсутствующие представления строятся
+        одним вызовом build(список рецептов) и сохраняются пачкой."""
+        keys = self.keys(recipes, prefix)
+        cache = get_shared_cache()
+        found = cache.get_many(keys.values())
+        missing = [
+            recipe for recipe in recipes if keys[recipe.id] not in found]
+        if missing:
+            built = {
+                keys[recipe.id]: data
+                for recipe, data in zip(missing, build(missing))
+            }
+            cache.set_many(built, timeout=settings.RECIPE_CACHE_TIMEOUT)
+            found.update(built)
+        return {pk: found[key] for pk, key in keys.items()}
+
+
+recipe_cache = RecipeRepresentationCache()
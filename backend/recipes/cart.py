@@ -0,0 +1,125 @@
+from itertools import product
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import CartIngredient, IngredientRecipe, ShoppingCart
+
+
+def recipe_amounts(recipe_id):
+    return dict(IngredientRecipe.objects.filter(
+        recipe_id=recipe_id).values_list('ingredient_id', 'amount'))
+
+
+@transaction.atomic
+def change_carts(user_ids, deltas):
+    """Меняет сводные списки покупок пользователей user_ids на deltas
+    (словарь id ингредиента -> изменение количества) за постоянное число
+    запросов: строки блокируются, пересчитываются и записываются пачкой.
+    Строки, количество в которых стало нулевым, удаляются."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas or not user_ids:
+        return
+    rows = {
+        (row.user_id, row.ingredient_id): row
+        for row in CartIngredient.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)
+    }
+    to_create = []
+    to_update = []
+    to_delete = []
+    for user_id, (ingredient_id, delta) in product(user_ids, deltas.items()):
+        row = rows.get((user_id, ingredient_id))
+        if row is None:
+            if delta > 0:
+                to_create.append(CartIngredient(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    amount=delta))
+        elif row.amount + delta > 0:
+            row.amount += delta
+            to_update.append(row)
+        else:
+            to_delete.append(row.id)
+    if to_delete:
+        CartIngredient.objects.filter(id__in=to_delete).delete()
+    if to_update:
+        CartIngredient.objects.bulk_update(to_update, ('amount',))
+    if to_create:
+        CartIngredient.objects.bulk_create(to_create)
+
+
+def change_user_cart(user_id, deltas):
+    change_carts([user_id], deltas)
+
+
+def recipes_amounts(recipe_ids):
+    """Суммарные количества ингредиентов нескольких рецептов."""
+    return dict(IngredientRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('ingredient_id').annotate(total=Sum('amount')).order_by())
+
+
+def add_recipe(user_id, recipe_id):
+    change_user_cart(user_id, recipe_amounts(recipe_id))
+
+
+def remove_recipe(user_id, recipe_id):
+    change_user_cart(user_id, {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipe_amounts(recipe_id).items()
+    })
+
+
+def add_recipes(user_id, recipe_ids):
+    change_user_cart(user_id, recipes_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    change_user_cart(user_id, {
+        ingredient_id: -amount
+        for ingredient_id, amount in recipes_amounts(recipe_ids).items()
+    })
+
+
+def change_recipe_in_carts(recipe_id, deltas):
+    """Переносит изменение ингредиентов рецепта в списки покупок всех
+    пользователей, у которых рецепт лежит в корзине, пачкой через
+    change_carts. Если рецепт ни у кого не лежит в корзине, выполняется
+    один запрос."""
+    if not any(deltas.values()):
+        return
+    user_ids = list(ShoppingCart.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+    if user_ids:
+        change_carts(user_ids, deltas)
+
+
+def expected_rows():
+    """Сводные списки покупок, посчитанные заново по корзинам:
+    итератор кортежей (id пользователя, id ингредиента, количество)."""
+    return IngredientRecipe.objects.filter(
+        recipe__shoppingcart__isnull=False
+    ).values_list(
+        'recipe__shoppingcart__user', 'ingredient'
+    ).annotate(
+        total=Sum('amount')
+    ).order_by().iterator()
+
+
+def carts_drift():
+    """Количество строк сводных списков, расходящихся с корзинами."""
+    stored = set(CartIngredient.objects.values_list(
+        'user_id', 'ingredient_id', 'amount'))
+    expected = set(expected_rows())
+    return len(stored ^ expected)
+
+
+@transaction.atomic
+def rebuild_carts(batch_size=5000):
+    CartIngredient.objects.all().delete()
+    CartIngredient.objects.bulk_create(
+        (CartIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                        amount=amount)
+         for user_id, ingredient_id, amount in expected_rows()),
+        batch_size=batch_size,
+    )
@@ -0,0 +1,87 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_delete, pre_delete
+from users.models import Subscribe, User
+
+from .models import Favorite, IngredientRecipe, Recipe, ShoppingCart
+
+# Денормализованные счетчики: модель и поле счетчика, модель, строки
+# которой считаются, и ее внешний ключ на модель счетчика.
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (Recipe, 'ingredients_count', IngredientRecipe, 'recipe'),
+    (User, 'subscriptions_count', Subscribe, 'user'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счетчик одной строки выражением F(), не опуская
+    его ниже нуля."""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)})
+
+
+@transaction.atomic
+def delete_counted(queryset):
+    """Удаляет строки queryset одним DELETE и уменьшает их счетчики из
+    COUNTERS пачкой: по одному UPDATE на счетчик и число удаленных строк,
+    приходящихся на одну запись. queryset строится на прокси-модели без
+    обработчиков сигналов (BulkFavorite, BulkShoppingCart и т.п.), иначе
+    QuerySet.delete() удалял бы строки по одной, а сигналы уменьшили бы
+    счетчики второй раз. Остальной учет (например, сводный список покупок)
+    остается на вызывающем коде."""
+    if (pre_delete.has_listeners(queryset.model)
+            or post_delete.has_listeners(queryset.model)):
+        raise ValueError(
+            f'На удаление {queryset.model.__name__} подписаны сигналы, '
+            'используйте прокси-модель без них')
+    source_model = queryset.model._meta.concrete_model
+    deleted = {
+        (model, field): Counter(queryset.values_list(
+            f'{foreign_key}_id', flat=True))
+        for model, field, source, foreign_key in COUNTERS
+        if source is source_model
+    }
+    queryset.delete()
+    for (model, field), counts in deleted.items():
+        by_count = defaultdict(list)
+        for pk, count in counts.items():
+            by_count[count].append(pk)
+        for count, pks in by_count.items():
+            model.objects.filter(pk__in=pks).update(
+                **{field: Greatest(F(field) - count, 0)})
+
+
+def actual_count(source, foreign_key):
+    return Coalesce(
+        Subquery(
+            source.objects.filter(**{foreign_key: OuterRef('pk')})
+            .order_by()
+            .values(foreign_key)
+            .annotate(count=Count('pk'))
+            .values('count')
+        ),
+        0,
+    )
+
+
+def counters_drift():
+    """Возвращает список (модель, поле, число строк с неверным счетчиком)
+    по всем счетчикам."""
+    return [
+        (model, field, model.objects.annotate(
+            actual=actual_count(source, foreign_key)
+        ).exclude(**{field: F('actual')}).count())
+        for model, field, source, foreign_key in COUNTERS
+    ]
+
+
+def rebuild_counters():
+    """Пересчитывает все счетчики одним UPDATE на каждое поле."""
+    for model, field, source, foreign_key in COUNTERS:
+        model.objects.update(**{field: actual_count(source, foreign_key)})
@@ -0,0 +1,150 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import (Image, ImageOps, ImageSequence, UnidentifiedImageError,
+                 features)
+
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+    thread_name_prefix='recipe-images',
+)
+
+# Параметры, с которыми пересохраняется оригинал без метаданных. GIF
+# пересохраняется по кадрам, см. _gif_without_metadata.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 90, 'optimize': True},
+    'PNG': {'optimize': True},
+}
+
+
+def schedule_image_processing(recipe_id):
+    """Ставит обработку изображения рецепта в очередь после фиксации
+    транзакции, чтобы фоновая задача увидела сохраненный рецепт."""
+    if settings.IMAGE_PROCESSING_ASYNC:
+        transaction.on_commit(
+            lambda: executor.submit(_run_in_worker, recipe_id))
+    else:
+        transaction.on_commit(lambda: process_recipe_image(recipe_id))
+
+
+def _run_in_worker(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception(
+            'Ошибка обработки изображения рецепта %s', recipe_id)
+    finally:
+        connections.close_all()
+
+
+def process_recipe_image(recipe_id):
+    """Проверяет изображение рецепта, удаляет из него метаданные и строит
+    уменьшенную копию. Если файл не является изображением, он удаляется
+    из рецепта."""
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', 'thumbnail').first()
+    if recipe is None or not recipe.image:
+        return
+    original = recipe.image.name
+    with recipe.image.open('rb') as image_file:
+        data = image_file.read()
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, SyntaxError, UnidentifiedImageError):
+        logger.warning('Рецепт %s: файл %s не является изображением',
+                       recipe_id, original)
+        if Recipe.objects.filter(pk=recipe_id, image=original).update(
+                image=None, thumbnail=None, updated_at=timezone.now()):
+            recipe.image.storage.delete(original)
+        return
+
+    image_format = image.format
+    image = ImageOps.exif_transpose(image)
+    stem = os.path.splitext(os.path.basename(original))[0]
+    storage = recipe.image.storage
+    updates = {
+        'thumbnail': storage.save(
+            f'recipes/thumbnails/{stem}.{thumbnail_extension()}',
+            ContentFile(_thumbnail(image))),
+    }
+    cleaned = _without_metadata(data, image, image_format)
+    if cleaned is not None:
+        updates['image'] = storage.save(original, ContentFile(cleaned))
+
+    # Рецепт мог получить новое изображение, пока шла обработка.
+    if Recipe.objects.filter(pk=recipe_id, image=original).update(
+            updated_at=timezone.now(), **updates):
+        if updates.get('image', original) != original:
+            storage.delete(original)
+        if recipe.thumbnail:
+            storage.delete(recipe.thumbnail.name)
+    else:
+        for name in updates.values():
+            storage.delete(name)
+
+
+def _without_metadata(data, image, image_format):
+    """Содержимое файла изображения без метаданных или None, если формат
+    не пересохраняется."""
+    if image_format == 'GIF':
+        return _gif_without_metadata(data)
+    if image_format not in SAVE_OPTIONS:
+        return None
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def _gif_without_metadata(data):
+    """GIF без комментариев и XMP. Кадры копируются по одному, чтобы
+    сохранить анимацию, длительность кадров и число повторов."""
+    frames = []
+    durations = []
+    with Image.open(io.BytesIO(data)) as image:
+        loop = image.info.get('loop')
+        for frame in ImageSequence.Iterator(image):
+            durations.append(frame.info.get('duration', 0))
+            frame = frame.copy()
+            for key in ('comment', 'xmp', 'extension'):
+                frame.info.pop(key, None)
+            frames.append(frame)
+    options = {'save_all': True, 'append_images': frames[1:],
+               'duration': durations}
+    if loop is not None:
+        options['loop'] = loop
+    buffer = io.BytesIO()
+    frames[0].save(buffer, 'GIF', **options)
+    return buffer.getvalue()
+
+
+def thumbnail_extension():
+    return 'webp' if features.check('webp') else 'jpg'
+
+
+def _thumbnail(image):
+    size = settings.RECIPE_THUMBNAIL_SIZE
+    thumbnail = image.copy()
+    thumbnail.thumbnail((size, size))
+    buffer = io.BytesIO()
+    if thumbnail_extension() == 'webp':
+        if thumbnail.mode not in ('RGB', 'RGBA'):
+            thumbnail = thumbnail.convert('RGBA')
+        thumbnail.save(buffer, 'WEBP', quality=80, method=4)
+    else:
+        thumbnail.convert('RGB').save(
+            buffer, 'JPEG', quality=80, optimize=True)
+    return buffer.getvalue()
@@ -0,0 +1,87 @@
+import io
+import timeit
+
+from api.v1.parsers import FastJSONParser, orjson
+from api.v1.renderers import FastJSONRenderer
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+TEXT = ('Нарежьте овощи, обжарьте на сливочном масле до золотистого цвета, '
+        'добавьте специи и тушите под крышкой 20 минут. ') * 8
+
+
+def recipe_page(recipes, ingredients):
+    """Страница списка рецептов в том виде, в каком ее отдает API."""
+    return {
+        'count': 1000,
+        'next': 'http://foodgram.ru/api/recipes/?limit=50&page=2',
+        'previous': None,
+        'results': [
+            {
+                'id': i,
+                'tags': [{'id': 1, 'name': 'Завтрак', 'color': '#e26c2d',
+                          'slug': 'breakfast'}],
+                'author': {'email': f'user{i}@foodgram.ru', 'id': i,
+                           'username': f'user{i}', 'first_name': 'Иван',
+                           'last_name': 'Петров', 'is_subscribed': False},
+                'ingredients': [
+                    {'id': j, 'name': f'Ингредиент {j}',
+                     'measurement_unit': 'г', 'amount': j * 10}
+                    for j in range(ingredients)
+                ],
+                'is_favorited': bool(i % 2),
+                'is_in_shopping_cart': False,
+                'name': f'Рецепт {i}',
+                'image': f'http://foodgram.ru/media/recipes/{i}.jpg',
+                'thumbnail': f'http://foodgram.ru/media/recipes/t/{i}.jpg',
+                'text': TEXT,
+                'cooking_time': 30,
+            }
+            for i in range(recipes)
+        ],
+    }
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость FastJSONRenderer и FastJSONParser со '
+            'стандартными JSONRenderer и JSONParser на страницах рецептов')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=50,
+                            help='Рецептов на странице')
+        parser.add_argument('--ingredients', type=int, default=10,
+                            help='Ингредиентов в рецепте')
+        parser.add_argument('--number', type=int, default=200,
+                            help='Повторов в одном замере')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Количество замеров, берется лучший')
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            raise CommandError('orjson не установлен, сравнивать не с чем')
+        data = recipe_page(options['recipes'], options['ingredients'])
+        body = JSONRenderer().render(data)
+        if FastJSONRenderer().render(data) != body:
+            raise CommandError('FastJSONRenderer отдает другой JSON')
+        self.stdout.write(f'Размер страницы: {len(body)} байт')
+
+        def parse(parser):
+            return lambda: parser.parse(io.BytesIO(body))
+
+        self.compare(options, 'render',
+                     lambda: JSONRenderer().render(data),
+                     lambda: FastJSONRenderer().render(data))
+        self.compare(options, 'parse',
+                     parse(JSONParser()), parse(FastJSONParser()))
+
+    def compare(self, options, name, standard, fast):
+        timings = [
+            min(timeit.repeat(func, number=options['number'],
+                              repeat=options['repeat'])) / options['number']
+            for func in (standard, fast)
+        ]
+        self.stdout.write(
+            f'{name}: json {timings[0] * 1000:.3f} мс, '
+            f'orjson {timings[1] * 1000:.3f} мс, '
+            f'ускорение {timings[0] / timings[1]:.1f}x')
@@ -0,0 +1,144 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.cache import ingredient_cache
+from recipes.models import Ingredient
+from recipes.search import ingredient_index
+
+DEFAULT_PATH = settings.BASE_DIR.parent / 'data' / 'ingredients.csv'
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[1]
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Читает массив объектов JSON (или JSON Lines) по частям, не загружая
+    файл в память целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        chunk = file.read(chunk_size)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in '[], \r\n\t':
+                position += 1
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item['name'], item['measurement_unit']
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise CommandError('Файл JSON обрезан или поврежден')
+            return
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV (название, единица измерения) '
+            'или JSON. Уже существующие ингредиенты пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH,
+                            type=Path)
+        parser.add_argument('--format', choices=('csv', 'json'),
+                            help='Формат файла, по умолчанию по расширению')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--copy',
+            action='store_true',
+            help='Загрузка через COPY (только PostgreSQL)',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        readers = {'csv': read_csv, 'json': read_json}
+        if file_format not in readers:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy поддерживается только PostgreSQL')
+        load = self.load_copy if options['copy'] else self.load_bulk
+
+        count_before = Ingredient.objects.count()
+        started = time.monotonic()
+        with open(path, encoding='utf-8', newline='') as file:
+            rows = load(batches(readers[file_format](file),
+                                options['batch_size']),
+                        started)
+        elapsed = time.monotonic() - started
+        created = Ingredient.objects.count() - count_before
+
+        ingredient_index.reset()
+        ingredient_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {rows}, добавлено ингредиентов: {created} '
+            f'за {elapsed:.2f} с ({rows / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def progress(self, rows, started):
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Обработано строк: {rows} '
+            f'({rows / max(elapsed, 1e-6):.0f} строк/с)')
+
+    def load_bulk(self, batches, started):
+        rows = 0
+        for batch in batches:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in batch),
+                ignore_conflicts=True,
+            )
+            rows += len(batch)
+            self.progress(rows, started)
+        return rows
+
+    @transaction.atomic
+    def load_copy(self, batches, started):
+        """Строки копируются через COPY во временную таблицу, а затем
+        переносятся одним INSERT ... ON CONFLICT DO NOTHING, который
+        пропускает ингредиенты, нарушающие unique_igredient."""
+        table = Ingredient._meta.db_table
+        rows = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(50)) '
+                'ON COMMIT DROP'
+            )
+            for batch in batches:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(batch)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_import FROM STDIN WITH (FORMAT csv)',
+                    buffer)
+                rows += len(batch)
+                self.progress(rows, started)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM ingredient_import ON CONFLICT DO NOTHING'
+            )
+        return rows
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.counters import counters_drift, rebuild_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает денормализованные счетчики избранного, корзины, '
+            'ингредиентов рецепта, рецептов автора и подписок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        drift = counters_drift()
+        for model, field, rows in drift:
+            self.stdout.write(
+                f'{model._meta.label}.{field}: расхождений {rows}')
+        if options['check']:
+            if any(rows for _, _, rows in drift):
+                raise CommandError('Найдены расхождения в счетчиках')
+            return
+        rebuild_counters()
+        self.stdout.write(self.style.SUCCESS('Счетчики пересчитаны'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from recipes.search import rebuild_search_vectors
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает поисковые векторы рецептов, например после '
+            'loaddata: сырые сохранения сигналы пропускают')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not rebuild_search_vectors(options['batch_size']):
+            self.stdout.write(
+                'Поисковые векторы используются только на PostgreSQL')
+            return
+        self.stdout.write(self.style.SUCCESS('Поисковые векторы пересчитаны'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.cart import carts_drift, rebuild_carts
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает сводные списки покупок пользователей по корзинам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        drift = carts_drift()
+        self.stdout.write(f'Расхождений в списках покупок: {drift}')
+        if options['check']:
+            if drift:
+                raise CommandError('Найдены расхождения в списках покупок')
+            return
+        rebuild_carts()
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересобраны'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from recipes.timeline import rebuild_timelines, timelines_drift
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает ленты подписок пользователей, подписанных не '
+            'меньше чем на TIMELINE_INBOX_THRESHOLD авторов')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только проверить расхождения, ничего не меняя',
+        )
+
+    def handle(self, *args, **options):
+        drift = timelines_drift()
+        self.stdout.write(f'Расхождений в лентах подписок: {drift}')
+        if options['check']:
+            if drift:
+                raise CommandError('Найдены расхождения в лентах подписок')
+            return
+        rebuild_timelines()
+        self.stdout.write(self.style.SUCCESS('Ленты подписок пересобраны'))
@@ -0,0 +1,268 @@
+import json
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import (CaptureQueriesContext, override_settings,
+                               setup_databases, teardown_databases)
+from recipes.cache import get_shared_cache
+from recipes.models import Recipe, ShoppingCart, Tag
+from rest_framework.test import APIClient
+from users.models import Subscribe, User
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+
+# Набор данных, на котором снят эталон. Замеры на другом наборе с ним
+# не сравниваются.
+DATASET = {
+    'users': 50,
+    'recipes': 500,
+    'ingredients': 300,
+    'ingredients_per_recipe': 8,
+    'favorites': 20,
+    'carts': 5,
+    'subscriptions': 5,
+    'seed': 0,
+}
+
+# Порог подписок для ленты из TimelineEntry на время замеров: в наборе
+# у каждого пользователя меньше подписок.
+TIMELINE_INBOX_THRESHOLD = 20
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAA'
+    'ggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+
+def percentile(quantiles, value):
+    return round(quantiles[value - 1] * 1000, 3)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку и число запросов основных эндпоинтов API '
+            'на синтетических данных в тестовой базе и сравнивает '
+            'результат с эталоном')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=1.0,
+            help='Допустимый рост p95 относительно эталона (1.0 = в 2 раза)',
+        )
+        parser.add_argument(
+            '--queries-only',
+            action='store_true',
+            help='Считать регрессией только рост числа запросов, рост p95 '
+                 'выводить как предупреждение',
+        )
+        parser.add_argument('--output', type=Path,
+                            help='Куда сохранить результаты в JSON')
+        parser.add_argument(
+            '--update-baseline',
+            action='store_true',
+            help='Записать результаты в файл эталона вместо сравнения',
+        )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations должно быть не меньше 2')
+        media_root = tempfile.mkdtemp()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            with override_settings(
+                    DEBUG=False, MEDIA_ROOT=media_root,
+                    IMAGE_PROCESSING_ASYNC=False,
+                    TIMELINE_INBOX_THRESHOLD=TIMELINE_INBOX_THRESHOLD):
+                call_command('seed_fake_data', stdout=self.stdout, **DATASET)
+                results = self.run_scenarios(
+                    options['iterations'], options['warmup'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = {'dataset': DATASET, 'scenarios': results}
+        self.print_results(results)
+        if options['output']:
+            self.write(options['output'], report)
+        if options['update_baseline']:
+            self.write(options['baseline'], report)
+            return
+        if not options['baseline'].exists():
+            raise CommandError(f'Нет файла эталона {options["baseline"]}')
+        baseline = json.loads(options['baseline'].read_text())
+        if baseline.get('dataset') != DATASET:
+            raise CommandError('Эталон снят на другом наборе данных, '
+                               'обновите его с --update-baseline')
+        queries, timings = self.compare(
+            results, baseline['scenarios'], options['tolerance'])
+        regressions = queries
+        if options['queries_only']:
+            for timing in timings:
+                self.stdout.write(self.style.WARNING(timing))
+        else:
+            regressions += timings
+        if regressions:
+            raise CommandError(
+                'Найдены регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий не найдено'))
+
+    def scenarios(self):
+        """Сценарии: имя, клиент, метод, адрес и функция, возвращающая
+        тело запроса по номеру итерации."""
+        user = User.objects.filter(
+            recipes_count__gt=0, shoppingcart__isnull=False
+        ).order_by('id').first()
+        recipe = Recipe.objects.filter(
+            author=user, shoppingcart__isnull=False).first() or (
+            Recipe.objects.filter(author=user).first())
+        ingredients = list(recipe.ingredientrecipe_set.values_list(
+            'ingredient_id', flat=True))
+        tags = list(Tag.objects.order_by('id').values_list('id', 'slug'))
+        ShoppingCart.objects.get_or_create(user=user, recipe=recipe)
+
+        anonymous = APIClient()
+        client = APIClient()
+        client.force_authenticate(user)
+        # Пользователь, подписки которого доводятся до порога, читает
+        # ленту из TimelineEntry, остальные - запросом по авторам.
+        inbox_user = User.objects.exclude(pk=user.pk).order_by('id').first()
+        authors = User.objects.exclude(pk=inbox_user.pk).exclude(
+            following__user=inbox_user).order_by('id')
+        for author in authors[:TIMELINE_INBOX_THRESHOLD
+                              - inbox_user.subscriptions_count]:
+            Subscribe.objects.create(user=inbox_user, author=author)
+        inbox_user.refresh_from_db()
+        inbox_client = APIClient()
+        inbox_client.force_authenticate(inbox_user)
+        tag_query = '&'.join(f'tags={slug}' for _, slug in tags[:2])
+        ingredient_query = '&'.join(
+            f'ingredients={pk}' for pk in ingredients)
+
+        def create(iteration):
+            return {
+                'name': f'Рецепт для замера {iteration}',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': IMAGE,
+                'tags': [tags[0][0]],
+                'ingredients': [{'id': pk, 'amount': 10}
+                                for pk in ingredients],
+            }
+
+        def update(iteration):
+            return {'ingredients': [{'id': pk, 'amount': 10 + iteration % 2}
+                                    for pk in ingredients]}
+
+        return (
+            ('recipe_list', anonymous, 'get', '/api/recipes/?limit=6', None),
+            ('recipe_list_auth', client, 'get', '/api/recipes/?limit=6',
+             None),
+            ('recipe_list_50', client, 'get', '/api/recipes/?limit=50',
+             None),
+            ('recipe_detail', client, 'get', f'/api/recipes/{recipe.id}/',
+             None),
+            ('recipe_filter_tags', client, 'get',
+             f'/api/recipes/?limit=6&{tag_query}', None),
+            ('recipe_filter_favorited', client, 'get',
+             '/api/recipes/?limit=6&is_favorited=1', None),
+            ('recipe_cookable', client, 'get',
+             f'/api/recipes/cookable/?limit=6&missing=2&{ingredient_query}',
+             None),
+            ('subscriptions', client, 'get',
+             '/api/users/subscriptions/?limit=6&recipes_limit=3', None),
+            ('timeline', client, 'get', '/api/recipes/timeline/?limit=6',
+             None),
+            ('timeline_inbox', inbox_client, 'get',
+             '/api/recipes/timeline/?limit=6', None),
+            ('download_shopping_cart', client, 'get',
+             '/api/recipes/download_shopping_cart/', None),
+            ('recipe_create', client, 'post', '/api/recipes/', create),
+            ('recipe_update', client, 'patch', f'/api/recipes/{recipe.id}/',
+             update),
+        )
+
+    def request(self, client, method, url, data, iteration):
+        response = getattr(client, method)(
+            url, data(iteration) if data else None, format='json')
+        if hasattr(response, 'streaming_content'):
+            b''.join(response.streaming_content)
+        if response.status_code >= 400:
+            raise CommandError(
+                f'{method.upper()} {url}: ответ {response.status_code}')
+
+    def run_scenarios(self, iterations, warmup):
+        results = {}
+        for name, client, method, url, data in self.scenarios():
+            # Число запросов считается без кешей, оставшихся от
+            # предыдущих сценариев.
+            get_shared_cache().clear()
+            reset_queries()
+            with CaptureQueriesContext(connection) as queries:
+                self.request(client, method, url, data, 0)
+            # Журнал запросов очищается в начале каждого запроса к API,
+            # поэтому их число запоминается сразу.
+            query_count = len(queries)
+            for iteration in range(1, warmup + 1):
+                self.request(client, method, url, data, iteration)
+            timings = []
+            for iteration in range(warmup + 1, warmup + iterations + 1):
+                started = time.perf_counter()
+                self.request(client, method, url, data, iteration)
+                timings.append(time.perf_counter() - started)
+            quantiles = statistics.quantiles(
+                timings, n=100, method='inclusive')
+            results[name] = {
+                'queries': query_count,
+                'p50_ms': percentile(quantiles, 50),
+                'p95_ms': percentile(quantiles, 95),
+                'p99_ms': percentile(quantiles, 99),
+            }
+        return results
+
+    def print_results(self, results):
+        self.stdout.write(
+            f'{"сценарий":<26}{"запросов":>10}{"p50, мс":>10}'
+            f'{"p95, мс":>10}{"p99, мс":>10}')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<26}{result["queries"]:>10}{result["p50_ms"]:>10}'
+                f'{result["p95_ms"]:>10}{result["p99_ms"]:>10}')
+
+    @staticmethod
+    def compare(results, baseline, tolerance):
+        """Списки регрессий по числу запросов и по времени. Число запросов
+        не должно расти вовсе, p95 может расти в пределах tolerance: время
+        на разных машинах заметно отличается."""
+        queries = []
+        timings = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if expected is None:
+                continue
+            if result['queries'] > expected['queries']:
+                queries.append(
+                    f'{name}: запросов {expected["queries"]} -> '
+                    f'{result["queries"]}')
+            if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+                timings.append(
+                    f'{name}: p95 {expected["p95_ms"]} мс -> '
+                    f'{result["p95_ms"]} мс')
+        return queries, timings
+
+    @staticmethod
+    def write(path, report):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2, ensure_ascii=False)
+                        + '\n')
@@ -0,0 +1,151 @@
+import random
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import ingredient_cache, tag_cache
+from recipes.cart import rebuild_carts
+from recipes.counters import rebuild_counters
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.search import ingredient_index, update_search_vectors
+from recipes.timeline import rebuild_timelines
+from users.models import Subscribe, User
+
+TAGS = (
+    ('breakfast', 'Завтрак', '#e26c2d'),
+    ('lunch', 'Обед', '#49b64e'),
+    ('dinner', 'Ужин', '#8775d2'),
+    ('dessert', 'Десерт', '#f9a62b'),
+    ('snack', 'Перекус', '#2d9ce2'),
+)
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, корзинами и подписками для нагрузочных замеров. '
+            'При одинаковом --seed данные получаются одинаковыми.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--ingredients', type=int, default=500,
+                            help='Сколько ингредиентов добавить в справочник')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8)
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном у пользователя')
+        parser.add_argument('--carts', type=int, default=5,
+                            help='Рецептов в корзине у пользователя')
+        parser.add_argument('--subscriptions', type=int, default=5,
+                            help='Подписок у пользователя')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'seed{options["seed"]}'
+        if User.objects.filter(
+                username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(
+                f'Данные с --seed {options["seed"]} уже созданы')
+
+        tag_ids = self.create_tags()
+        ingredient_ids = self.create_ingredients(options['ingredients'])
+        user_ids = self.create_users(options['users'])
+        recipe_ids = self.create_recipes(options['recipes'], user_ids)
+        self.create_recipe_links(
+            recipe_ids, tag_ids, ingredient_ids,
+            options['ingredients_per_recipe'])
+        self.create_user_recipes(Favorite, user_ids, recipe_ids,
+                                 options['favorites'])
+        self.create_user_recipes(ShoppingCart, user_ids, recipe_ids,
+                                 options['carts'])
+        self.create_subscriptions(user_ids, options['subscriptions'])
+
+        # bulk_create не отправляет сигналы, поэтому денормализованные
+        # данные пересчитываются целиком.
+        rebuild_counters()
+        rebuild_carts()
+        rebuild_timelines()
+        update_search_vectors(
+            Recipe.objects.filter(search_vector=None).values('pk'))
+        ingredient_index.reset()
+        ingredient_cache.invalidate()
+        tag_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}'))
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_tags(self):
+        if not Tag.objects.exists():
+            self.bulk_create(Tag, (
+                Tag(slug=slug, name=name, color=color)
+                for slug, name, color in TAGS))
+        return list(Tag.objects.order_by('id').values_list('id', flat=True))
+
+    def create_ingredients(self, count):
+        self.bulk_create(Ingredient, (
+            Ingredient(name=f'{self.prefix} ингредиент {i}',
+                       measurement_unit=self.random.choice(UNITS))
+            for i in range(count)))
+        return list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+
+    def create_users(self, count):
+        password = make_password('password')
+        self.bulk_create(User, (
+            User(username=f'{self.prefix}_user{i}',
+                 email=f'{self.prefix}_user{i}@foodgram.ru',
+                 first_name=f'Имя{i}', last_name=f'Фамилия{i}',
+                 password=password)
+            for i in range(count)))
+        return list(User.objects.filter(
+            username__startswith=f'{self.prefix}_'
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, count, user_ids):
+        if not user_ids:
+            return []
+        self.bulk_create(Recipe, (
+            Recipe(author_id=self.random.choice(user_ids),
+                   name=f'Рецепт {i}',
+                   text=f'Описание рецепта {i}. ' * 10,
+                   cooking_time=self.random.randint(5, 180))
+            for i in range(count)))
+        return list(Recipe.objects.filter(
+            author__in=user_ids).order_by('id').values_list('id', flat=True))
+
+    def sample(self, population, count):
+        return self.random.sample(population, min(count, len(population)))
+
+    def create_recipe_links(self, recipe_ids, tag_ids, ingredient_ids,
+                            per_recipe):
+        recipe_tag = Recipe.tags.through
+        self.bulk_create(recipe_tag, (
+            recipe_tag(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.sample(tag_ids, self.random.randint(1, 2))))
+        self.bulk_create(IngredientRecipe, (
+            IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=self.random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(ingredient_ids, per_recipe)))
+
+    def create_user_recipes(self, model, user_ids, recipe_ids, count):
+        self.bulk_create(model, (
+            model(user_id=user_id, recipe_id=recipe_id)
+            for user_id in user_ids
+            for recipe_id in self.sample(recipe_ids, count)))
+
+    def create_subscriptions(self, user_ids, count):
+        self.bulk_create(Subscribe, (
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in self.sample(
+                [pk for pk in user_ids if pk != user_id], count)))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from recipes.recommendations import update_neighbours
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает списки похожих рецептов по совместным '
+            'добавлениям в избранное и корзину. По умолчанию только для '
+            'рецептов, добавления которых изменились с прошлого расчета. '
+            'Нужны numpy и scipy.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Пересчитать списки всех рецептов',
+        )
+        parser.add_argument('--neighbours', type=int,
+                            help='Сколько похожих рецептов хранить')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            updated = update_neighbours(
+                full=options['full'], k=options['neighbours'],
+                batch_size=options['batch_size'])
+        except ImportError as error:
+            raise CommandError(
+                f'Для расчета рекомендаций нужны numpy и scipy: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Пересчитано рецептов: {updated} '
+            f'за {time.perf_counter() - started:.1f} с'))
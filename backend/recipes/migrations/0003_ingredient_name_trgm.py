@@ -0,0 +1,38 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+INDEXES = (
+    ('recipes_ingredient_name_trgm', '"name" gin_trgm_ops'),
+    ('recipes_ingredient_name_upper_trgm', 'UPPER("name") gin_trgm_ops'),
+)
+
+
+def create_indexes(apps, schema_editor):
+    """GIN-индексы pg_trgm есть только в PostgreSQL, на остальных базах
+    поиск ингредиентов работает через индекс в памяти процесса."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, expression in INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{name}" '
+            f'ON "recipes_ingredient" USING gin ({expression})'
+        )
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{name}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:11
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    for field, model_name in (('favorites_count', 'Favorite'),
+                              ('cart_count', 'ShoppingCart')):
+        source = apps.get_model('recipes', model_name)
+        Recipe.objects.update(**{field: Coalesce(Subquery(
+            source.objects.filter(recipe=OuterRef('pk')).order_by()
+            .values('recipe').annotate(count=Count('pk')).values('count')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество добавлений в корзину'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество добавлений в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='recipes/thumbnails/', verbose_name='Миниатюра изображения'),
+        ),
+    ]
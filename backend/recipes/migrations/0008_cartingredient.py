@@ -0,0 +1,51 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:16
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_cart_ingredients(apps, schema_editor):
+    CartIngredient = apps.get_model('recipes', 'CartIngredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    rows = IngredientRecipe.objects.filter(
+        recipe__shoppingcart__isnull=False
+    ).values_list(
+        'recipe__shoppingcart__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    CartIngredient.objects.bulk_create(
+        (CartIngredient(user_id=user_id, ingredient_id=ingredient_id,
+                        amount=amount)
+         for user_id, ingredient_id, amount in rows.iterator()),
+        batch_size=5000,
+    )
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0007_ingredient_unique_igredient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to='recipes.ingredient', verbose_name='Ингридиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_ingredients', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Ингридиент в списке покупок',
+                'verbose_name_plural': 'Ингридиенты в списке покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cartingredient',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_cartingredient'),
+        ),
+        migrations.RunPython(fill_cart_ingredients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+# Автоматическая таблица связи рецептов с тегами не описана моделью,
+# поэтому индекс (tag_id, recipe_id) для фильтра по тегам создается SQL.
+# Он покрывает запрос целиком: id рецептов берутся прямо из индекса.
+RECIPE_TAGS_INDEX = 'recipes_recipe_tags_tag_recipe_idx'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_cartingredient'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-pub_date', '-id'], name='recipe_author_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_favorites_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-cart_count', '-id'], name='recipe_cart_count_idx'),
+        ),
+        migrations.RunSQL(
+            f'CREATE INDEX "{RECIPE_TAGS_INDEX}" '
+            f'ON "recipes_recipe_tags" ("tag_id", "recipe_id")',
+            f'DROP INDEX "{RECIPE_TAGS_INDEX}"',
+        ),
+    ]
@@ -0,0 +1,58 @@
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, TextField, Value
+from django.db.models.functions import Coalesce
+
+SEARCH_INDEX = 'recipe_search_vector_idx'
+SEARCH_CONFIG = 'russian'
+
+
+def create_index(apps, schema_editor):
+    """GIN-индекс и сами векторы нужны только на PostgreSQL, на остальных
+    базах поиск идет по подстроке, см. recipes.search.search_recipes.
+    Выражение вектора повторяет recipes.search.recipe_search_vector на
+    момент миграции."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    ingredient_names = Subquery(
+        apps.get_model('recipes', 'IngredientRecipe').objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    apps.get_model('recipes', 'Recipe').objects.update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Coalesce(ingredient_names, Value(''),
+                                output_field=TextField()),
+                       weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    ))
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS "{SEARCH_INDEX}" '
+        f'ON "recipes_recipe" USING gin ("search_vector")'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS "{SEARCH_INDEX}"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_ingredients_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeNeighbours',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='neighbours', serialize=False, to='recipes.recipe', verbose_name='Рецепт')),
+                ('recipes', models.JSONField(default=list, verbose_name='id похожих рецептов')),
+                ('scores', models.JSONField(default=list, verbose_name='Близость')),
+                ('interactions', models.PositiveIntegerField(default=0, verbose_name='Добавлений в избранное и корзину на момент расчета')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата расчета')),
+            ],
+            options={
+                'verbose_name': 'Похожие рецепты',
+                'verbose_name_plural': 'Похожие рецепты',
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    """Раскладывает ленты пользователей, у которых подписок уже не
+    меньше порога, см. recipes.timeline."""
+    Subscribe = apps.get_model('users', 'Subscribe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    rows = Subscribe.objects.filter(
+        user__subscriptions_count__gte=settings.TIMELINE_INBOX_THRESHOLD,
+        author__recipes__isnull=False,
+    ).values_list('user_id', 'author_id', 'author__recipes__id',
+                  'author__recipes__pub_date').order_by()
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, author_id=author_id,
+                       recipe_id=recipe_id, pub_date=pub_date)
+         for user_id, author_id, recipe_id, pub_date in rows.iterator()),
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_recipeneighbours'),
+        ('users', '0003_user_subscriptions_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Дата публикации')),
+                ('author', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор рецепта')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.recipe', verbose_name='Рецепт')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Рецепт в ленте',
+                'verbose_name_plural': 'Лента подписок',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='timelineentry',
+            index=models.Index(fields=['user', '-pub_date', '-recipe'], name='timeline_user_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique_timelineentry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
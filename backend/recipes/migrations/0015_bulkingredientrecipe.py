@@ -0,0 +1,24 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkIngredientRecipe',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('recipes.ingredientrecipe',),
+        ),
+    ]
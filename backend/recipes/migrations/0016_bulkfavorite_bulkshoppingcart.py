@@ -0,0 +1,35 @@
+# Generated by Django 4.1.4 on 2026-10-18 03:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_bulkingredientrecipe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkFavorite',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('recipes.favorite',),
+        ),
+        migrations.CreateModel(
+            name='BulkShoppingCart',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('recipes.shoppingcart',),
+        ),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
 from django.db.models import UniqueConstraint
@@ -80,6 +81,13 @@ class Recipe(models.Model):
         width_field=None,
         max_length=None,
     )
+    thumbnail = models.ImageField(
+        'Миниатюра изображения',
+        upload_to='recipes/thumbnails/',
+        null=True,
+        blank=True,
+        editable=False,
+    )
     text = models.TextField('Описание рецепта')
     cooking_time = models.PositiveIntegerField(
         'Время приготовления в мин.',
@@ -88,11 +96,40 @@ class Recipe(models.Model):
             1, 'Время приготовления не может занимать меньше минуты')]
     )
     pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    favorites_count = models.PositiveIntegerField(
+        'Количество добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        'Количество добавлений в корзину',
+        default=0,
+        editable=False,
+    )
+    ingredients_count = models.PositiveIntegerField(
+        'Количество ингредиентов',
+        default=0,
+        editable=False,
+    )
+    # Название, ингредиенты и описание для полнотекстового поиска.
+    # Заполняется только на PostgreSQL, см. search.update_search_vectors.
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         ordering = ('-pub_date', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('author', '-pub_date', '-id'),
+                         name='recipe_author_pub_date_idx'),
+            models.Index(fields=('-favorites_count', '-id'),
+                         name='recipe_favorites_count_idx'),
+            models.Index(fields=('-cart_count', '-id'),
+                         name='recipe_cart_count_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -117,11 +154,26 @@ class IngredientRecipe(models.Model):
         verbose_name_plural = 'Ингридиенты в рецепте'
         constraints = [UniqueConstraint(
             fields=('recipe', 'ingredient'), name='unique_igredientrecipe')]
+        # Обратный индекс: рецепты по ингредиенту, см. cookable.
+        indexes = [
+            models.Index(fields=('ingredient', 'recipe'),
+                         name='recipe_ingredient_lookup_idx'),
+        ]
 
     def __str__(self) -> str:
         return f'{self.recipe} {self.ingredient}'
 
 
+class BulkIngredientRecipe(IngredientRecipe):
+    """Та же таблица, что у IngredientRecipe, но без обработчиков сигналов:
+    QuerySet.delete() через эту модель удаляет строки одним DELETE. Учет
+    удаленных строк (счетчик, вектор, списки покупок) выполняет вызывающий
+    код, см. WriteRecipeSerializer.update_ingredients."""
+
+    class Meta:
+        proxy = True
+
+
 class Favorite(models.Model):
     """Избранное"""
     user = models.ForeignKey(
@@ -166,3 +218,111 @@ class ShoppingCart(models.Model):
         verbose_name_plural = 'Корзина'
         constraints = [UniqueConstraint(
             fields=('user', 'recipe'), name='unique_shoppingcart')]
+
+
+class BulkFavorite(Favorite):
+    """Избранное без обработчиков сигналов, см. counters.delete_counted."""
+
+    class Meta:
+        proxy = True
+
+
+class BulkShoppingCart(ShoppingCart):
+    """Корзина без обработчиков сигналов, см. counters.delete_counted."""
+
+    class Meta:
+        proxy = True
+
+
+class CartIngredient(models.Model):
+    """Сводный список покупок: суммарное количество каждого ингредиента
+    по всем рецептам в корзине пользователя. Обновляется при изменении
+    корзины и ингредиентов рецептов в ней, см. recipes.cart"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='cart_ingredients',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингридиент',
+        related_name='cart_ingredients',
+        on_delete=models.CASCADE
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Ингридиент в списке покупок'
+        verbose_name_plural = 'Ингридиенты в списке покупок'
+        constraints = [UniqueConstraint(
+            fields=('user', 'ingredient'), name='unique_cartingredient')]
+
+    def __str__(self):
+        return f'{self.user} {self.ingredient} {self.amount}'
+
+
+class RecipeNeighbours(models.Model):
+    """Похожие рецепты: заранее посчитанный список ближайших соседей
+    рецепта по совместным добавлениям в избранное и корзину, по убыванию
+    близости. Пересчитывается командой update_recommendations, см.
+    recipes.recommendations"""
+    recipe = models.OneToOneField(
+        Recipe,
+        verbose_name='Рецепт',
+        related_name='neighbours',
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+    recipes = models.JSONField('id похожих рецептов', default=list)
+    scores = models.JSONField('Близость', default=list)
+    interactions = models.PositiveIntegerField(
+        'Добавлений в избранное и корзину на момент расчета',
+        default=0,
+    )
+    updated_at = models.DateTimeField('Дата расчета', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Похожие рецепты'
+        verbose_name_plural = 'Похожие рецепты'
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.recipes}'
+
+
+class TimelineEntry(models.Model):
+    """Лента подписок пользователя, разложенная заранее: рецепты авторов,
+    на которых он подписан. Ведется только для пользователей с большим
+    числом подписок, см. recipes.timeline"""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        related_name='timeline',
+        on_delete=models.CASCADE
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        related_name='timeline_entries',
+        on_delete=models.CASCADE
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор рецепта',
+        related_name='+',
+        on_delete=models.CASCADE
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [UniqueConstraint(
+            fields=('user', 'recipe'), name='unique_timelineentry')]
+        indexes = [
+            models.Index(fields=('user', '-pub_date', '-recipe'),
+                         name='timeline_user_pub_date_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
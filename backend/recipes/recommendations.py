@@ -0,0 +1,162 @@
+"""Рекомендации рецептов по совместным добавлениям в избранное и корзину.
+
+Близость двух рецептов - косинус между их столбцами в матрице
+пользователь x рецепт, где значение - вес добавления (INTERACTION_WEIGHTS).
+Матрица близости считается пачками строк разреженным умножением
+(numpy и scipy нужны только для расчета и импортируются внутри функций),
+для каждого рецепта сохраняется top-k соседей в RecipeNeighbours.
+Запросы к API только читают эти списки."""
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import Favorite, Recipe, RecipeNeighbours, ShoppingCart
+
+# Вес добавления рецепта в избранное и в корзину.
+INTERACTION_WEIGHTS = (
+    (Favorite, 1.0),
+    (ShoppingCart, 0.5),
+)
+
+
+def import_numeric():
+    """numpy и scipy.sparse. ImportError, если они не установлены."""
+    import numpy
+    from scipy import sparse
+    return numpy, sparse
+
+
+def interaction_matrix(chunk_size=100000):
+    """Разреженная матрица рецепт x пользователь (CSR) и отсортированный
+    массив id рецептов ее строк. Пары читаются курсором прямо в массивы
+    numpy, без списка объектов в памяти."""
+    numpy, sparse = import_numeric()
+    pairs = []
+    weights = []
+    for model, weight in INTERACTION_WEIGHTS:
+        rows = model.objects.order_by().values_list(
+            'recipe_id', 'user_id').iterator(chunk_size=chunk_size)
+        array = numpy.fromiter(
+            chain.from_iterable(rows), dtype=numpy.int64).reshape(-1, 2)
+        pairs.append(array)
+        weights.append(numpy.full(len(array), weight, dtype=numpy.float32))
+    pairs = numpy.concatenate(pairs)
+    recipe_ids, recipe_rows = numpy.unique(pairs[:, 0], return_inverse=True)
+    user_ids, user_columns = numpy.unique(pairs[:, 1], return_inverse=True)
+    # Повторяющиеся пары (рецепт и в избранном, и в корзине) суммируются.
+    matrix = sparse.csr_matrix(
+        (numpy.concatenate(weights), (recipe_rows, user_columns)),
+        shape=(len(recipe_ids), len(user_ids)))
+    return matrix, recipe_ids
+
+
+def top_neighbours(matrix, recipe_ids, rows, k):
+    """Для строк rows матрицы interaction_matrix возвращает итератор
+    кортежей (id рецепта, id соседей, близость) с k ближайшими соседями
+    по убыванию близости."""
+    numpy, _ = import_numeric()
+    norms = numpy.sqrt(numpy.asarray(
+        matrix.multiply(matrix).sum(axis=1)).ravel())
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(rows), settings.RECOMMENDATIONS_BLOCK_SIZE):
+        block = rows[start:start + settings.RECOMMENDATIONS_BLOCK_SIZE]
+        # Совместные добавления рецептов блока со всеми рецептами.
+        similarity = (matrix[block] @ transposed).tocsr()
+        counts = numpy.diff(similarity.indptr)
+        similarity.data /= (
+            numpy.repeat(norms[block], counts)
+            * norms[similarity.indices])
+        for position, row in enumerate(block):
+            begin, end = similarity.indptr[position:position + 2]
+            columns = similarity.indices[begin:end]
+            scores = similarity.data[begin:end]
+            own = columns != row
+            columns, scores = columns[own], scores[own]
+            if len(scores) > k:
+                best = numpy.argpartition(-scores, k)[:k]
+                columns, scores = columns[best], scores[best]
+            order = numpy.lexsort((recipe_ids[columns], -scores))
+            yield (
+                int(recipe_ids[row]),
+                recipe_ids[columns[order]].tolist(),
+                numpy.round(scores[order].astype(float), 4).tolist(),
+            )
+
+
+def stale_recipes(full=False):
+    """id рецептов, списки соседей которых нужно пересчитать, и число их
+    добавлений в избранное и корзину. Без full - только рецепты без списка
+    и рецепты, у которых это число изменилось с прошлого расчета."""
+    recipes = Recipe.objects.annotate(
+        interactions=F('favorites_count') + F('cart_count'))
+    if not full:
+        recipes = recipes.exclude(neighbours__interactions=F('interactions'))
+    return dict(recipes.order_by().values_list('id', 'interactions'))
+
+
+def update_neighbours(full=False, k=None, batch_size=1000):
+    """Пересчитывает списки соседей устаревших рецептов (stale_recipes)
+    и возвращает их количество.
+    Строки матрицы близости считаются только для этих рецептов, но по
+    всем добавлениям, поэтому их списки точные. Списки остальных рецептов
+    могут немного отставать, пока не изменятся их собственные добавления
+    или не будет выполнен полный пересчет."""
+    numpy, _ = import_numeric()
+    k = k or settings.RECOMMENDATIONS_NEIGHBOURS
+    # Счетчики читаются до матрицы: добавления, появившиеся между этими
+    # запросами, попадут и в следующий расчет.
+    interactions = stale_recipes(full)
+    if not interactions:
+        return 0
+    matrix, recipe_ids = interaction_matrix()
+    stale = numpy.fromiter(interactions, dtype=numpy.int64)
+    positions = numpy.searchsorted(recipe_ids, stale)
+    known = positions < len(recipe_ids)
+    known[known] = recipe_ids[positions[known]] == stale[known]
+    rows = numpy.sort(positions[known])
+    neighbours = chain(
+        top_neighbours(matrix, recipe_ids, rows, k),
+        # У рецептов без добавлений соседей нет.
+        ((int(pk), [], []) for pk in stale[~known]),
+    )
+    batch = []
+    for recipe_id, recipes, scores in neighbours:
+        batch.append(RecipeNeighbours(
+            recipe_id=recipe_id, recipes=recipes, scores=scores,
+            interactions=interactions[recipe_id]))
+        if len(batch) >= batch_size:
+            save_neighbours(batch)
+            batch = []
+    save_neighbours(batch)
+    return len(stale)
+
+
+@transaction.atomic
+def save_neighbours(batch):
+    RecipeNeighbours.objects.bulk_create(
+        batch, update_conflicts=True, unique_fields=('recipe', ),
+        update_fields=('recipes', 'scores', 'interactions', 'updated_at'))
+
+
+def recommended_recipe_ids(user_id, limit):
+    """id рекомендованных пользователю рецептов: соседи его последних
+    рецептов в избранном и корзине, упорядоченные по сумме близости.
+    Рецепты, которые уже есть у пользователя, пропускаются. Читает только
+    готовые списки соседей, за три запроса."""
+    history = settings.RECOMMENDATIONS_HISTORY
+    seen = set()
+    seeds = []
+    for model, _ in INTERACTION_WEIGHTS:
+        recipe_ids = model.objects.filter(user_id=user_id).order_by(
+            '-id').values_list('recipe_id', flat=True)
+        seen.update(recipe_ids)
+        seeds.extend(recipe_ids[:history])
+    scores = {}
+    for recipes, similarities in RecipeNeighbours.objects.filter(
+            recipe_id__in=seeds).values_list('recipes', 'scores'):
+        for recipe_id, score in zip(recipes, similarities):
+            if recipe_id not in seen:
+                scores[recipe_id] = scores.get(recipe_id, 0) + score
+    return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
@@ -0,0 +1,236 @@
+import bisect
+import re
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector,
+                                            TrigramWordSimilarity)
+from django.db import connections
+from django.db.models import (Case, Count, Exists, F, IntegerField, OuterRef,
+                              Q, Subquery, TextField, Value, When)
+from django.db.models.functions import Coalesce
+
+from .models import Ingredient, IngredientRecipe, Recipe
+
+# Конфигурация полнотекстового поиска PostgreSQL: рецепты на русском.
+SEARCH_CONFIG = 'russian'
+
+PREFIX, SUBSTRING, FUZZY = range(3)
+
+
+def search_ingredients(queryset, query, limit=None):
+    """Поиск ингредиентов для автодополнения.
+    Сначала отдаются совпадения по началу названия, затем по подстроке,
+    затем похожие названия с опечатками. Количество результатов
+    ограничено настройкой INGREDIENT_SEARCH_LIMIT.
+    На PostgreSQL поиск идет по GIN-индексам pg_trgm, на остальных базах
+    (SQLite в тестах и локально) по индексу в памяти процесса."""
+    query = query.strip()
+    if limit is None:
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+    if not query:
+        return queryset[:limit]
+    if connections[queryset.db].vendor == 'postgresql':
+        return _search_postgresql(queryset, query, limit)
+    ids = ingredient_index.search(query, limit)
+    return queryset.filter(id__in=ids).order_by(Case(
+        *(When(id=pk, then=Value(position))
+          for position, pk in enumerate(ids)),
+        output_field=IntegerField(),
+    ))
+
+
+def _search_postgresql(queryset, query, limit):
+    return queryset.filter(
+        Q(name__icontains=query) | Q(name__trigram_word_similar=query)
+    ).annotate(
+        match=Case(
+            When(name__istartswith=query, then=Value(PREFIX)),
+            When(name__icontains=query, then=Value(SUBSTRING)),
+            default=Value(FUZZY),
+        ),
+        similarity=TrigramWordSimilarity(query, 'name'),
+    ).order_by('match', '-similarity', 'name')[:limit]
+
+
+def _trigrams(text):
+    """Триграммы слов строки по правилам pg_trgm: слово приводится к
+    нижнему регистру и дополняется двумя пробелами в начале и одним
+    в конце."""
+    trigrams = set()
+    for word in re.findall(r'\w+', text.lower()):
+        word = f'  {word} '
+        trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return trigrams
+
+
+class IngredientIndex:
+    """Индекс названий ингредиентов в памяти процесса.
+    Строится при первом поиске и сбрасывается сигналами при изменении
+    таблицы ингредиентов."""
+
+    similarity_threshold = 0.5
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+
+    def reset(self):
+        with self._lock:
+            self._data = None
+
+    def _load(self):
+        with self._lock:
+            if self._data is None:
+                entries = sorted(
+                    (name.lower(), pk)
+                    for pk, name in Ingredient.objects.values_list(
+                        'id', 'name'))
+                postings = {}
+                for name, pk in entries:
+                    for trigram in _trigrams(name):
+                        postings.setdefault(trigram, []).append(pk)
+                self._data = entries, postings
+            return self._data
+
+    def search(self, query, limit):
+        entries, postings = self._load()
+        query = query.lower()
+        found = []
+        seen = set()
+
+        start = bisect.bisect_left(entries, (query,))
+        for name, pk in entries[start:]:
+            if len(found) >= limit or not name.startswith(query):
+                break
+            found.append(pk)
+            seen.add(pk)
+
+        if len(found) < limit:
+            substring = sorted(
+                (name.find(query), name, pk)
+                for name, pk in entries
+                if pk not in seen and query in name
+            )
+            for _, _, pk in substring[:limit - len(found)]:
+                found.append(pk)
+                seen.add(pk)
+
+        query_trigrams = _trigrams(query)
+        if len(found) < limit and query_trigrams:
+            hits = Counter(
+                pk
+                for trigram in query_trigrams
+                for pk in postings.get(trigram, ())
+                if pk not in seen
+            )
+            threshold = self.similarity_threshold * len(query_trigrams)
+            fuzzy = sorted(
+                (-count, pk) for pk, count in hits.items()
+                if count >= threshold
+            )
+            found.extend(pk for _, pk in fuzzy[:limit - len(found)])
+        return found
+
+
+ingredient_index = IngredientIndex()
+
+
+def recipe_search_vector():
+    """Выражение для Recipe.search_vector: название рецепта (вес A),
+    названия ингредиентов (B) и описание (C)."""
+    ingredient_names = Subquery(
+        IngredientRecipe.objects.filter(
+            recipe=OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(Coalesce(ingredient_names, Value(''),
+                                output_field=TextField()),
+                       weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def search_vectors_supported():
+    return connections[Recipe.objects.db].vendor == 'postgresql'
+
+
+def update_search_vectors(recipes):
+    """Пересчитывает search_vector рецептов одним UPDATE. recipes -
+    список id или queryset рецептов. На других базах поиск вектор не
+    использует, и запрос не выполняется."""
+    if not search_vectors_supported():
+        return
+    Recipe.objects.filter(pk__in=recipes).update(
+        search_vector=recipe_search_vector())
+
+
+def rebuild_search_vectors(batch_size=5000):
+    """Пересчитывает search_vector всех рецептов пачками по batch_size,
+    например после loaddata. Возвращает False, если база векторы не
+    использует."""
+    if not search_vectors_supported():
+        return False
+    last_id = 0
+    while True:
+        batch = list(Recipe.objects.filter(pk__gt=last_id).order_by(
+            'pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return True
+        update_search_vectors(batch)
+        last_id = batch[-1]
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск рецептов по названию, ингредиентам и
+    описанию, результаты упорядочены по релевантности.
+    На PostgreSQL запрос в синтаксисе websearch_to_tsquery ищется по
+    GIN-индексу search_vector и ранжируется ts_rank. На остальных базах
+    (SQLite в тестах и локально) каждое слово запроса ищется подстрокой,
+    и выше стоят рецепты, в названии которых есть весь запрос."""
+    query = query.strip()
+    if not query:
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.filter(search_vector=search_query).annotate(
+            search_rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-search_rank', '-pub_date', '-id')
+    for word in query.split():
+        queryset = queryset.filter(
+            Q(name__icontains=word)
+            | Q(text__icontains=word)
+            | Exists(IngredientRecipe.objects.filter(
+                recipe=OuterRef('pk'), ingredient__name__icontains=word))
+        )
+    return queryset.alias(
+        search_rank=Case(When(name__icontains=query, then=Value(1)),
+                         default=Value(0))
+    ).order_by('-search_rank', '-pub_date', '-id')
+
+
+def match_recipes(ingredient_ids, max_missing=0):
+    """Рецепты, которые можно приготовить из ингредиентов ingredient_ids,
+    докупив не больше max_missing ингредиентов. Возвращает словари
+    recipe_id, matched (сколько ингредиентов рецепта есть) и missing
+    (сколько не хватает), сначала рецепты с меньшим числом недостающих.
+    Считается одним GROUP BY по индексу (ingredient, recipe) таблицы
+    связи: просматриваются только строки с переданными ингредиентами,
+    а общее число ингредиентов рецепта берется из ingredients_count,
+    поэтому время запроса не зависит от размера каталога целиком."""
+    return IngredientRecipe.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).values('recipe_id').annotate(
+        matched=Count('id'),
+        missing=F('recipe__ingredients_count') - Count('id'),
+    ).filter(
+        missing__lte=max_missing
+    ).order_by('missing', '-matched', '-recipe_id')
@@ -0,0 +1,188 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from import_export.signals import post_import
+from users.models import Subscribe, User
+
+from . import cart, timeline
+from .cache import ingredient_cache, tag_cache
+from .counters import change_counter
+from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart, Tag)
+from .search import ingredient_index, update_search_vectors
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    """Сбрасывает индекс поиска и кеш справочника ингредиентов."""
+    ingredient_index.reset()
+    ingredient_cache.invalidate()
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, raw, **kwargs):
+    """Название ингредиента входит в поисковые векторы рецептов."""
+    if not created and not raw:
+        update_search_vectors(
+            Recipe.objects.filter(ingredients=instance).values('pk'))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    tag_cache.invalidate()
+
+
+# Поля автора, которые входят в представление рецепта.
+AUTHOR_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, created, raw, update_fields, **kwargs):
+    """Изменение профиля автора отмечается как изменение его рецептов,
+    чтобы обновились их закешированные представления и ETag."""
+    if created or raw or (update_fields
+                          and not AUTHOR_FIELDS.intersection(update_fields)):
+        return
+    Recipe.objects.filter(author=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_import)
+def reference_data_imported(model, **kwargs):
+    """Импорт через админку может сохранять строки пачкой, минуя
+    post_save, поэтому кеш сбрасывается и по окончании импорта."""
+    if model is Ingredient:
+        ingredient_changed()
+    elif model is Tag:
+        tag_changed()
+
+
+@receiver(post_save, sender=Favorite)
+def favorite_created(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(Recipe, instance.recipe_id, 'favorites_count', 1)
+
+
+@receiver(post_delete, sender=Favorite)
+def favorite_deleted(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_created(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(Recipe, instance.recipe_id, 'cart_count', 1)
+        cart.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def shopping_cart_deleting(instance, **kwargs):
+    """Сводный список покупок уменьшается до удаления, пока ингредиенты
+    рецепта еще не удалены каскадом вместе с ним."""
+    cart.remove_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, 'cart_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+        timeline.recipe_published(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, raw, **kwargs):
+    """Вектор пересчитывается после фиксации транзакции, когда записаны и
+    ингредиенты: WriteRecipeSerializer сохраняет их уже после рецепта.
+    Сырые сохранения (loaddata) пропускаются, после загрузки дампа векторы
+    пересчитывает команда rebuild_search_vectors."""
+    if not raw:
+        recipe_id = instance.id
+        transaction.on_commit(lambda: update_search_vectors([recipe_id]))
+
+
+def recipe_ingredients_changed(added=None, removed=None):
+    """Переносит поштучное изменение ингредиента рецепта в счетчик
+    ингредиентов, поисковый вектор и списки покупок пользователей, у которых
+    рецепт лежит в корзине, и отмечается как изменение рецепта, чтобы
+    обновились его закешированное представление и ETag. added и
+    removed - кортежи (id рецепта, id ингредиента, количество) новой и
+    прежней строки."""
+    counts = Counter()
+    deltas = defaultdict(Counter)
+    for sign, row in ((1, added), (-1, removed)):
+        if row is not None:
+            recipe_id, ingredient_id, amount = row
+            counts[recipe_id] += sign
+            deltas[recipe_id][ingredient_id] += sign * amount
+    for recipe_id, recipe_deltas in deltas.items():
+        if counts[recipe_id]:
+            change_counter(Recipe, recipe_id, 'ingredients_count',
+                           counts[recipe_id])
+        cart.change_recipe_in_carts(recipe_id, recipe_deltas)
+        update_search_vectors([recipe_id])
+    Recipe.objects.filter(pk__in=list(deltas)).update(
+        updated_at=timezone.now())
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def recipe_ingredient_saving(instance, raw, **kwargs):
+    """Запоминает строку в том виде, в каком она сохранена в базе, чтобы
+    после записи учесть разницу с ней."""
+    instance._saved_row = None
+    if not raw and instance.pk is not None:
+        instance._saved_row = IngredientRecipe.objects.filter(
+            pk=instance.pk).values_list(
+                'recipe_id', 'ingredient_id', 'amount').first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_saved(instance, raw, **kwargs):
+    """Ингредиенты, измененные поштучно (например, в админке). Пакетные
+    изменения в WriteRecipeSerializer обходят сигналы и учитываются там."""
+    if raw:
+        return
+    recipe_ingredients_changed(
+        added=(instance.recipe_id, instance.ingredient_id, instance.amount),
+        removed=instance._saved_row)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredient_deleted(instance, origin=None, **kwargs):
+    """Учитываются только удаления самих строк и ингредиентов. Если строка
+    удалена каскадом вместе с рецептом (рецептом, его автором и т.д.),
+    обновлять нечего: списки покупок уже уменьшил shopping_cart_deleting."""
+    if isinstance(origin, QuerySet):
+        origin = origin.model
+    elif origin is not None:
+        origin = type(origin)
+    if origin not in (IngredientRecipe, Ingredient):
+        return
+    recipe_ingredients_changed(removed=(
+        instance.recipe_id, instance.ingredient_id, instance.amount))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_created(instance, created, raw, **kwargs):
+    if created and not raw:
+        change_counter(User, instance.user_id, 'subscriptions_count', 1)
+        timeline.author_followed(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_deleted(instance, **kwargs):
+    change_counter(User, instance.user_id, 'subscriptions_count', -1)
+    timeline.author_unfollowed(instance.user_id, instance.author_id)
@@ -0,0 +1,1790 @@
+import base64
+import datetime
+import decimal
+import itertools
+import json
+import re
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from api.profiling import RequestProfile
+from api.v1.parsers import FastJSONParser
+from api.v1.renderers import FastJSONRenderer
+from api.v1.serializers import (GetRecipeSerializer, ShortRecipeSerializer,
+                                SubscribeSerializer, recipe_data,
+                                short_recipe_data, subscription_data)
+from api.v1.views import RecipeViewSet
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import OuterRef, Prefetch, Value
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import (APIClient, APIRequestFactory,
+                                 force_authenticate)
+from users.models import Subscribe, User
+
+from .cache import get_shared_cache, ingredient_cache, tag_cache
+from .cart import carts_drift, change_recipe_in_carts, rebuild_carts
+from .counters import (change_counter, counters_drift, delete_counted,
+                       rebuild_counters)
+from .models import (BulkIngredientRecipe, CartIngredient, Favorite,
+                     Ingredient, IngredientRecipe, Recipe, RecipeNeighbours,
+                     ShoppingCart, Tag, TimelineEntry)
+from .timeline import rebuild_timelines, timelines_drift
+
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAgMAAABieywaAAAA'
+    'CVBMVEUAAAD///9fX1/S0ecCAAAACXBIWXMAAA7EAAAOxAGVKw4bAAAACklEQVQImWNoAAAA'
+    'ggCByxOyYQAAAABJRU5ErkJggg=='
+)
+
+
+def tearDownModule():
+    shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+
+class RecipeListQueriesTest(TestCase):
+    """Количество запросов к базе при получении списка рецептов не должно
+    зависеть от количества рецептов на странице."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='pass')
+            for i in range(3)
+        ]
+        Subscribe.objects.create(user=cls.user, author=cls.authors[0])
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (('breakfast', '#aaaaaa'),
+                                ('dinner', '#bbbbbb'))
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(4)
+        ]
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                author=cls.authors[i % len(cls.authors)],
+                name=f'recipe{i}',
+                text='text',
+                cooking_time=10,
+            )
+            recipe.tags.set(tags)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=i + 1)
+                for ingredient in ingredients
+            )
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        get_shared_cache().clear()
+
+    def test_recipe_list_fixed_queries_anonymous(self):
+        for limit in (1, 6, 12):
+            with self.assertNumQueries(5):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_cached_recipe_list(self):
+        self.client.get('/api/recipes/?limit=12')
+        self.client.force_authenticate(self.user)
+        # Только количество рецептов и сама страница.
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/recipes/?limit=12')
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_recipe_list_fixed_queries_authenticated(self):
+        self.client.force_authenticate(self.user)
+        for limit in (1, 6, 12):
+            with self.assertNumQueries(5):
+                response = self.client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_recipe_list_flags(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/recipes/?limit=12')
+        for item in response.data['results']:
+            recipe = Recipe.objects.get(pk=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                Favorite.objects.filter(user=self.user,
+                                        recipe=recipe).exists())
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(user=self.user,
+                                            recipe=recipe).exists())
+            self.assertEqual(item['author']['is_subscribed'],
+                             recipe.author == self.authors[0])
+            self.assertEqual(len(item['ingredients']), 4)
+            self.assertEqual(len(item['tags']), 2)
+
+
+class RecipeFilterQueryPlanTest(TestCase):
+    """Ни одно сочетание параметров RecipeFilter не должно приводить
+    к последовательному чтению больших таблиц. На PostgreSQL
+    последовательное чтение запрещается настройкой enable_seqscan, и если
+    оно все равно попало в план, значит подходящего индекса нет."""
+
+    large_tables = {
+        'recipes_recipe', 'recipes_recipe_tags', 'recipes_favorite',
+        'recipes_shoppingcart', 'recipes_ingredientrecipe',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (('breakfast', '#aaaaaa'),
+                                ('dinner', '#bbbbbb'))
+        ]
+        for i in range(10):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'recipe{i}', text='text',
+                cooking_time=10)
+            recipe.tags.set(tags[:i % 2 + 1])
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def explain(self, params):
+        request = APIRequestFactory().get('/api/recipes/', params)
+        force_authenticate(request, self.user)
+        view = RecipeViewSet(request=Request(request), action='list',
+                             format_kwarg=None, kwargs={})
+        queryset = view.filter_queryset(view.get_queryset())[:6]
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def sequential_scans(self, plan):
+        if connection.vendor == 'postgresql':
+            tables = re.findall(r'Seq Scan on (\w+)', plan)
+        else:
+            tables = re.findall(
+                r'\bSCAN (?:TABLE )?(\w+)(?: AS \w+)?\s*$', plan, re.M)
+        return self.large_tables.intersection(tables)
+
+    def test_filters_use_indexes(self):
+        filters = {
+            'tags': ['breakfast', 'dinner'],
+            'tags_mode': 'all',
+            'author': self.user.id,
+            'is_favorited': 1,
+            'is_in_shopping_cart': 1,
+        }
+        if connection.vendor == 'postgresql':
+            # На других базах поиск идет по подстроке без индекса.
+            filters['search'] = 'recipe'
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                for ordering in (None, '-favorites_count', '-cart_count'):
+                    params = {name: filters[name] for name in names}
+                    if ordering:
+                        params['ordering'] = ordering
+                    with self.subTest(params=params):
+                        plan = self.explain(params)
+                        self.assertFalse(self.sequential_scans(plan), plan)
+
+
+class TagFilterTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        tags = {
+            name: Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (('breakfast', '#aaaaaa'),
+                                ('lunch', '#bbbbbb'),
+                                ('dinner', '#cccccc'))
+        }
+        cls.recipes = {}
+        for name, slugs in (('both', ('breakfast', 'lunch')),
+                            ('breakfast', ('breakfast',)),
+                            ('late', ('lunch', 'dinner')),
+                            ('all', ('breakfast', 'lunch', 'dinner')),
+                            ('none', ())):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text='text', cooking_time=1)
+            recipe.tags.set([tags[slug] for slug in slugs])
+            cls.recipes[name] = recipe
+
+    def names(self, query):
+        response = self.client.get(f'/api/recipes/?limit=10&{query}')
+        self.assertEqual(response.status_code, 200)
+        names = [item['name'] for item in response.data['results']]
+        self.assertEqual(response.data['count'], len(names))
+        return sorted(names)
+
+    def test_any_of_tags_without_duplicates(self):
+        self.assertEqual(
+            self.names('tags=breakfast&tags=lunch'),
+            ['all', 'both', 'breakfast', 'late'])
+
+    def test_all_of_tags(self):
+        self.assertEqual(
+            self.names('tags=breakfast&tags=lunch&tags_mode=all'),
+            ['all', 'both'])
+        self.assertEqual(
+            self.names('tags=breakfast&tags=lunch&tags=dinner&tags_mode=all'),
+            ['all'])
+
+    def test_queries_do_not_depend_on_tag_count(self):
+        for mode in ('any', 'all'):
+            for tags in (['breakfast'], ['breakfast', 'lunch', 'dinner']):
+                query = '&'.join(f'tags={tag}' for tag in tags)
+                with self.subTest(mode=mode, tags=tags):
+                    get_shared_cache().clear()
+                    with self.assertNumQueries(6):
+                        self.client.get(
+                            f'/api/recipes/?{query}&tags_mode={mode}')
+
+
+class DownloadShoppingCartTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@foodgram.ru', password='pass')
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        for amount in (10, 20):
+            recipe = Recipe.objects.create(
+                author=cls.user, name='recipe', text='text', cooking_time=1)
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=sugar, amount=amount)
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=salt, amount=1)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, export_format):
+        response = self.client.get(
+            f'/api/recipes/download_shopping_cart/?format={export_format}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_download_formats(self):
+        self.assertEqual(
+            self.download('txt').decode(),
+            'Список покупок:\nсахар(г) - 30\nсоль(г) - 2\n')
+        self.assertEqual(
+            self.download('csv').decode('utf-8-sig').splitlines()[1:],
+            ['сахар,г,30', 'соль,г,2'])
+        pdf = self.download('pdf')
+        self.assertTrue(pdf.startswith(b'%PDF-1.4'))
+        self.assertIn('(сахар \\(г\\) - 30)'.encode('cp1251'), pdf)
+        self.assertTrue(pdf.endswith(b'%%EOF\n'))
+
+
+class CartAggregateTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        cls.buyers = [
+            User.objects.create_user(username=f'buyer{i}',
+                                     email=f'buyer{i}@foodgram.ru',
+                                     password='pass')
+            for i in range(2)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        tag_cache.invalidate()
+        self.recipes = []
+        for amount in (1, 2):
+            recipe = Recipe.objects.create(
+                author=self.author, name='recipe', text='text',
+                cooking_time=1)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=amount)
+                for ingredient in self.ingredients[:2]
+            )
+            self.recipes.append(recipe)
+
+    def cart(self, user):
+        return dict(CartIngredient.objects.filter(
+            user=user).values_list('ingredient_id', 'amount'))
+
+    def test_cart_follows_api_calls(self):
+        client = APIClient()
+        client.force_authenticate(self.buyers[0])
+        first, second = self.ingredients[:2]
+        for recipe in self.recipes:
+            client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(self.cart(self.buyers[0]), {first.id: 3,
+                                                     second.id: 3})
+
+        client.delete(f'/api/recipes/{self.recipes[0].id}/shopping_cart/')
+        self.assertEqual(self.cart(self.buyers[0]), {first.id: 2,
+                                                     second.id: 2})
+
+        response = client.get('/api/recipes/shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row['name'], row['amount']) for row in response.data],
+            [('ingredient0', 2), ('ingredient1', 2)])
+
+    def test_cart_follows_recipe_changes(self):
+        for buyer in self.buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.recipes[0])
+        ShoppingCart.objects.create(user=self.buyers[0],
+                                    recipe=self.recipes[1])
+        client = APIClient()
+        client.force_authenticate(self.author)
+        first, second, third = self.ingredients
+        response = client.patch(
+            f'/api/recipes/{self.recipes[0].id}/',
+            {'ingredients': [{'id': first.id, 'amount': 5},
+                             {'id': third.id, 'amount': 4}]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.cart(self.buyers[0]),
+                         {first.id: 7, second.id: 2, third.id: 4})
+        self.assertEqual(self.cart(self.buyers[1]),
+                         {first.id: 5, third.id: 4})
+
+        self.recipes[1].delete()
+        self.assertEqual(self.cart(self.buyers[0]),
+                         {first.id: 5, third.id: 4})
+
+    def test_cart_follows_single_row_changes(self):
+        # Строки ингредиентов, измененные поштучно, как в админке.
+        for buyer in self.buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.recipes[0])
+        first, second, third = self.ingredients
+        row = IngredientRecipe.objects.get(recipe=self.recipes[0],
+                                           ingredient=first)
+        row.amount = 6
+        row.save()
+        self.assertEqual(self.cart(self.buyers[1]),
+                         {first.id: 6, second.id: 1})
+        self.assertEqual(carts_drift(), 0)
+
+        row.ingredient = third
+        row.save()
+        self.assertEqual(self.cart(self.buyers[1]),
+                         {second.id: 1, third.id: 6})
+
+        IngredientRecipe.objects.create(recipe=self.recipes[0],
+                                        ingredient=first, amount=2)
+        IngredientRecipe.objects.get(recipe=self.recipes[0],
+                                     ingredient=second).delete()
+        self.assertEqual(self.cart(self.buyers[1]),
+                         {first.id: 2, third.id: 6})
+        self.assertEqual(carts_drift(), 0)
+
+    def test_recipe_changes_in_fixed_queries(self):
+        for buyer in self.buyers:
+            ShoppingCart.objects.create(user=buyer, recipe=self.recipes[0])
+        first, second = self.ingredients[:2]
+        extra = [
+            Ingredient.objects.create(name=f'extra{i}', measurement_unit='г')
+            for i in range(6)
+        ]
+        queries = []
+        for ingredients in (extra[:1], extra[1:]):
+            deltas = {ingredient.id: 2 for ingredient in ingredients}
+            deltas[first.id] = 1
+            with CaptureQueriesContext(connection) as context:
+                change_recipe_in_carts(self.recipes[0].id, deltas)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+        change_recipe_in_carts(self.recipes[0].id, {second.id: -1})
+        cart = self.cart(self.buyers[1])
+        self.assertEqual(cart[first.id], 3)
+        self.assertNotIn(second.id, cart)
+        self.assertEqual(cart[extra[5].id], 2)
+
+        with self.assertNumQueries(1):
+            change_recipe_in_carts(self.recipes[1].id, {first.id: 5})
+
+    def test_author_deleted(self):
+        author = User.objects.create_user(
+            username='other', email='other@foodgram.ru', password='pass')
+        recipe = Recipe.objects.create(
+            author=author, name='recipe', text='text', cooking_time=1)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in self.ingredients[:2]
+        )
+        for cart_recipe in (self.recipes[0], recipe):
+            ShoppingCart.objects.create(user=self.buyers[0],
+                                        recipe=cart_recipe)
+        author.delete()
+        first, second = self.ingredients[:2]
+        self.assertEqual(self.cart(self.buyers[0]), {first.id: 1,
+                                                     second.id: 1})
+        self.assertEqual(carts_drift(), 0)
+
+    def test_rebuild_command_fixes_drift(self):
+        ShoppingCart.objects.create(user=self.buyers[0],
+                                    recipe=self.recipes[0])
+        CartIngredient.objects.filter(user=self.buyers[0]).update(amount=9)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_shopping_carts', check=True,
+                         stdout=StringIO())
+        call_command('rebuild_shopping_carts', stdout=StringIO())
+        call_command('rebuild_shopping_carts', check=True, stdout=StringIO())
+        self.assertEqual(self.cart(self.buyers[0]),
+                         {self.ingredients[0].id: 1,
+                          self.ingredients[1].id: 1})
+
+
+class IngredientSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('сахар', 'сахарная пудра', 'тростниковый сахар',
+                     'соль', 'ванильный сахар', 'сало'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        ingredient_cache.invalidate()
+
+    def search(self, query):
+        response = self.client.get('/api/ingredients/', {'name': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_matches_go_first(self):
+        self.assertEqual(
+            self.search('сах')[:4],
+            ['сахар', 'сахарная пудра', 'ванильный сахар',
+             'тростниковый сахар'])
+
+    def test_typo_tolerance(self):
+        self.assertEqual(self.search('сохар')[:1], ['сахар'])
+
+    def test_index_follows_changes(self):
+        self.assertEqual(self.search('перец'), [])
+        Ingredient.objects.create(name='перец', measurement_unit='г')
+        self.assertEqual(self.search('перец'), ['перец'])
+
+    def test_results_are_limited(self):
+        with self.settings(INGREDIENT_SEARCH_LIMIT=2):
+            self.assertEqual(len(self.search('са')), 2)
+
+
+class ReferenceDataCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.tag = Tag.objects.create(
+            name='breakfast', color='#aaaaaa', slug='breakfast')
+
+    def setUp(self):
+        tag_cache.invalidate()
+
+    def test_cached_tags_and_conditional_get(self):
+        self.client.get('/api/tags/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+        not_modified = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        Tag.objects.create(name='dinner', color='#bbbbbb', slug='dinner')
+        response = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class WriteRecipeValidationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@foodgram.ru', password='pass')
+        cls.tag = Tag.objects.create(
+            name='breakfast', color='#aaaaaa', slug='breakfast')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(40)
+        ]
+
+    def setUp(self):
+        tag_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, ingredients, tags=None):
+        return {
+            'name': 'recipe',
+            'text': 'text',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': tags or [self.tag.id],
+            'ingredients': ingredients,
+        }
+
+    def test_all_errors_are_reported_with_index(self):
+        first = self.ingredients[0].id
+        response = self.client.post('/api/recipes/', self.payload(
+            [{'id': first, 'amount': 1},
+             {'id': first, 'amount': 1},
+             {'id': 0, 'amount': 0}],
+            tags=[self.tag.id, 0, self.tag.id],
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['ingredients']), {1, 2})
+        self.assertEqual(set(response.data['ingredients'][2]),
+                         {'id', 'amount'})
+        self.assertEqual(set(response.data['tags']), {1, 2})
+
+    def test_amount_fits_integer_column(self):
+        response = self.client.post('/api/recipes/', self.payload(
+            [{'id': self.ingredients[0].id, 'amount': 10 ** 12}],
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['ingredients'][0]), {'amount'})
+
+    def test_tag_deleted_by_another_process(self):
+        tag = Tag.objects.create(name='lunch', color='#bbbbbb', slug='lunch')
+        payload = self.payload(
+            [{'id': self.ingredients[0].id, 'amount': 1}],
+            tags=[self.tag.id, tag.id])
+        response = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        # Другой процесс не сбрасывает кеш справочника этого процесса.
+        with mock.patch.object(tag_cache, 'invalidate'):
+            tag.delete()
+        response = self.client.post('/api/recipes/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['tags']), {1})
+
+    def test_create_queries_do_not_depend_on_ingredient_count(self):
+        queries = []
+        for count in (1, 2, 40):
+            ingredients = [{'id': ingredient.id, 'amount': 5}
+                           for ingredient in self.ingredients[:count]]
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(
+                    '/api/recipes/', self.payload(ingredients),
+                    format='json')
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(len(response.data['ingredients']), count)
+            queries.append(len(context))
+        self.assertEqual(queries[1], queries[2])
+
+
+class UpdateRecipeTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='cook', email='cook@foodgram.ru', password='pass')
+        cls.tags = [
+            Tag.objects.create(name=name, color=color, slug=name)
+            for name, color in (('breakfast', '#aaaaaa'),
+                                ('dinner', '#bbbbbb'))
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        tag_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='recipe', text='text', cooking_time=5,
+            ingredients_count=2)
+        self.recipe.tags.set([self.tags[0]])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=self.recipe, ingredient=ingredient,
+                             amount=1)
+            for ingredient in self.ingredients[:2]
+        )
+
+    def test_only_changed_rows_are_touched(self):
+        kept, changed = self.recipe.ingredientrecipe_set.order_by('id')
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': [
+                {'id': self.ingredients[0].id, 'amount': 1},
+                {'id': self.ingredients[1].id, 'amount': 7},
+                {'id': self.ingredients[2].id, 'amount': 3},
+            ]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        rows = {row.ingredient_id: row
+                for row in self.recipe.ingredientrecipe_set.all()}
+        self.assertEqual(rows[self.ingredients[0].id].pk, kept.pk)
+        self.assertEqual(rows[self.ingredients[1].id].pk, changed.pk)
+        self.assertEqual(rows[self.ingredients[1].id].amount, 7)
+        self.assertEqual(rows[self.ingredients[2].id].amount, 3)
+
+    def test_removed_rows_are_counted_once(self):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': [{'id': self.ingredients[2].id, 'amount': 3}]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.ingredients_count, 1)
+        self.assertEqual(self.recipe.ingredientrecipe_set.count(), 1)
+
+    def test_removal_queries_do_not_depend_on_count(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        extra = [
+            Ingredient.objects.create(name=f'extra{i}', measurement_unit='г')
+            for i in range(10)
+        ]
+        queries = []
+        for count in (2, 10):
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=self.recipe, ingredient=ingredient,
+                                 amount=1)
+                for ingredient in extra[:count]
+            )
+            rebuild_counters()
+            rebuild_carts()
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(
+                    f'/api/recipes/{self.recipe.id}/',
+                    {'ingredients': [
+                        {'id': self.ingredients[0].id, 'amount': count}]},
+                    format='json',
+                )
+            self.assertEqual(response.status_code, 200, response.data)
+            queries.append(len(context))
+            self.recipe.refresh_from_db()
+            self.assertEqual(self.recipe.ingredients_count, 1)
+            self.assertEqual(carts_drift(), 0)
+        self.assertEqual(queries[0], queries[1])
+
+    def test_partial_update_keeps_ingredients(self):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'name': 'new name', 'tags': [self.tags[1].id]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'new name')
+        self.assertEqual(list(self.recipe.tags.all()), [self.tags[1]])
+        self.assertEqual(self.recipe.ingredientrecipe_set.count(), 2)
+
+
+class CountersTest(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            username='cook', email='cook@foodgram.ru', password='pass')
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='recipe', text='text', cooking_time=5)
+
+    def test_counters_follow_api_calls(self):
+        self.client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.client.post(f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.cart_count, 1)
+        self.assertEqual(self.user.recipes_count, 1)
+
+        self.client.delete(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+        self.client.delete(f'/api/recipes/{self.recipe.id}/')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.recipes_count, 0)
+
+    def test_change_counter_stops_at_zero(self):
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=1)
+        change_counter(Recipe, self.recipe.pk, 'favorites_count', -3)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+    def test_delete_counted(self):
+        other = Recipe.objects.create(
+            author=self.user, name='other', text='text', cooking_time=5)
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+        for recipe, count in ((self.recipe, 3), (other, 1)):
+            for ingredient in ingredients[:count]:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+        with self.assertRaises(ValueError):
+            delete_counted(IngredientRecipe.objects.all())
+        delete_counted(BulkIngredientRecipe.objects.filter(
+            ingredient__in=ingredients[:2]))
+        self.assertEqual(dict(Recipe.objects.values_list(
+            'name', 'ingredients_count')), {'recipe': 1, 'other': 0})
+        self.assertFalse(any(drift for _, _, drift in counters_drift()))
+
+    def test_rebuild_command_fixes_drift(self):
+        Recipe.objects.update(favorites_count=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', '--check', stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        call_command('rebuild_counters', '--check', stdout=StringIO())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 0)
+
+
+class SubscriptionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        for i in range(4):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                password='pass')
+            Subscribe.objects.create(user=cls.user, author=author)
+            for j in range(5):
+                Recipe.objects.create(author=author, name=f'recipe{j}',
+                                      text='text', cooking_time=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_limit(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                '/api/users/subscriptions/?limit=4&recipes_limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 4)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertEqual(author['recipes_count'], 5)
+            self.assertTrue(author['is_subscribed'])
+
+    def test_invalid_recipes_limit(self):
+        response = self.client.get(
+            '/api/users/subscriptions/?recipes_limit=abc')
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        for i in range(7):
+            Recipe.objects.create(author=author, name=f'recipe{i}',
+                                  text='text', cooking_time=1)
+
+    def test_cursor_pages_cover_feed_without_count(self):
+        url = '/api/recipes/?pagination=cursor&limit=3'
+        ids = []
+        while url:
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertNotIn('count', response.data)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(
+            ids, list(Recipe.objects.order_by('-pub_date', '-id')
+                      .values_list('id', flat=True)))
+
+    def test_exact_count(self):
+        response = self.client.get(
+            '/api/recipes/?pagination=cursor&limit=3&count=exact')
+        self.assertEqual(response.data['count'], 7)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_ASYNC=False)
+class RecipeImageProcessingTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='cook', email='cook@foodgram.ru', password='pass')
+        self.tag = Tag.objects.create(
+            name='breakfast', color='#aaaaaa', slug='breakfast')
+        self.ingredient = Ingredient.objects.create(
+            name='ingredient', measurement_unit='г')
+        tag_cache.invalidate()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/recipes/', {
+                'name': 'recipe',
+                'text': 'text',
+                'cooking_time': 10,
+                'image': image,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            }, format='json')
+
+    def post_recipe(self, image):
+        response = self.post(image)
+        self.assertEqual(response.status_code, 201, response.data)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def test_thumbnail_without_metadata(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'camera'
+        buffer = BytesIO()
+        Image.new('RGB', (1200, 800), 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes())
+        recipe = self.post_recipe(
+            'data:image/jpeg;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+        with Image.open(recipe.image.path) as image:
+            self.assertFalse(image.getexif())
+        with Image.open(recipe.thumbnail.path) as thumbnail:
+            self.assertLessEqual(max(thumbnail.size), 480)
+
+    def test_gif_without_metadata(self):
+        frames = [Image.new('P', (40, 40), color) for color in (1, 2, 3)]
+        buffer = BytesIO()
+        frames[0].save(buffer, 'GIF', save_all=True,
+                       append_images=frames[1:], duration=[100, 200, 300],
+                       loop=0, comment=b'secret')
+        recipe = self.post_recipe(
+            'data:image/gif;base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
+
+        with open(recipe.image.path, 'rb') as file:
+            self.assertNotIn(b'secret', file.read())
+        with Image.open(recipe.image.path) as image:
+            self.assertEqual(image.n_frames, 3)
+            self.assertNotIn('comment', image.info)
+
+    def test_broken_image_is_rejected(self):
+        response = self.post(
+            'data:image/png;base64,'
+            + base64.b64encode(b'\x89PNG\r\n\x1a\nbroken').decode())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_truncated_image_is_dropped(self):
+        # verify() не декодирует пиксели, поэтому обрезанный JPEG
+        # принимается и отбрасывается уже при фоновой обработке.
+        buffer = BytesIO()
+        Image.effect_noise((200, 200), 50).convert('RGB').save(
+            buffer, 'JPEG')
+        recipe = self.post_recipe(
+            'data:image/jpeg;base64,'
+            + base64.b64encode(buffer.getvalue()[:2000]).decode())
+        self.assertFalse(recipe.image)
+        self.assertFalse(recipe.thumbnail)
+
+
+class LoadIngredientsTest(TestCase):
+
+    def test_load_csv_and_json(self):
+        data = settings.BASE_DIR.parent / 'data'
+        call_command('load_ingredients', data / 'ingredients.csv',
+                     '--batch-size', '500', stdout=StringIO())
+        count = Ingredient.objects.count()
+        self.assertGreater(count, 2000)
+        call_command('load_ingredients', data / 'ingredients.json',
+                     stdout=StringIO())
+        self.assertEqual(Ingredient.objects.count(), count)
+
+
+class SeedFakeDataTest(TestCase):
+
+    def seed(self, **options):
+        call_command('seed_fake_data', users=5, recipes=20, ingredients=10,
+                     ingredients_per_recipe=3, favorites=4, carts=2,
+                     subscriptions=2, stdout=StringIO(), **options)
+
+    def test_seed_is_reproducible_and_consistent(self):
+        self.seed()
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Recipe.objects.count(), 20)
+        self.assertEqual(IngredientRecipe.objects.count(), 60)
+        self.assertEqual(Favorite.objects.count(), 20)
+        self.assertEqual(Subscribe.objects.count(), 10)
+        self.assertFalse(any(drift for _, _, drift in counters_drift()))
+        self.assertEqual(carts_drift(), 0)
+        favorites = list(Favorite.objects.values_list(
+            'user__username', 'recipe__name').order_by('id'))
+
+        with self.assertRaises(CommandError):
+            self.seed()
+
+        User.objects.all().delete()
+        Ingredient.objects.all().delete()
+        self.seed()
+        self.assertEqual(
+            list(Favorite.objects.values_list(
+                'user__username', 'recipe__name').order_by('id')),
+            favorites)
+
+
+class RequestProfilingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        for i in range(3):
+            Recipe.objects.create(author=cls.user, name=f'recipe{i}',
+                                  text='text', cooking_time=1)
+
+    def test_not_profiled_by_default(self):
+        response = self.client.get('/api/recipes/',
+                                   HTTP_X_REQUEST_PROFILE='1')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_staff_token(self):
+        token = Token.objects.create(user=self.user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = client.get('/api/recipes/', HTTP_X_REQUEST_PROFILE='1')
+        self.assertNotIn('Server-Timing', response)
+
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        with self.assertLogs('api.profiling'):
+            response = client.get('/api/recipes/',
+                                  HTTP_X_REQUEST_PROFILE='1')
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(REQUEST_PROFILING_SAMPLE_RATE=1,
+                       REQUEST_PROFILING_SLOW_QUERY_MS=0,
+                       REQUEST_PROFILING_SLOW_QUERIES=2)
+    def test_sampled_request(self):
+        get_shared_cache().clear()
+        with self.assertLogs('api.profiling') as logs:
+            response = self.client.get('/api/recipes/')
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="5 queries"', timing)
+        self.assertIn('serializer;dur=', timing)
+        record = json.loads(logs.records[0].getMessage().split(' ', 2)[2])
+        self.assertEqual(record['view'], 'recipes-list')
+        self.assertEqual(record['queries'], 5)
+        self.assertEqual(
+            [item.levelname for item in logs.records[1:]],
+            ['WARNING', 'WARNING'])
+
+    @override_settings(REQUEST_PROFILING_REPEATED_QUERIES=3)
+    def test_repeated_queries(self):
+        profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            for recipe in Recipe.objects.all():
+                Recipe.objects.filter(id__in=[recipe.id, 0]).exists()
+            Recipe.objects.filter(id__in=[1, 2, 3]).exists()
+        self.assertEqual(profile.queries, 5)
+        [(sql, count)] = profile.repeated_queries()
+        self.assertEqual(count, 4)
+        self.assertIn('IN (%s, ...)', sql)
+
+
+class ConditionalRecipeRequestsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        cls.recipes = [
+            Recipe.objects.create(author=cls.user, name=f'recipe{i}',
+                                  text='text', cooking_time=1)
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_not_modified(self, url, etag):
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def assert_modified(self, url, etag):
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_recipe_detail(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        etag = self.client.get(url)['ETag']
+        self.assert_not_modified(url, etag)
+
+        self.client.post(f'/api/recipes/{recipe.id}/favorite/')
+        etag = self.assert_modified(url, etag)
+        self.assert_not_modified(url, etag)
+
+        recipe.name = 'new name'
+        recipe.save()
+        self.assert_modified(url, etag)
+
+    def test_recipe_list(self):
+        url = '/api/recipes/?limit=2'
+        etag = self.client.get(url)['ETag']
+        self.assert_not_modified(url, etag)
+
+        Recipe.objects.create(author=self.user, name='new', text='text',
+                              cooking_time=1)
+        etag = self.assert_modified(url, etag)
+        self.assert_not_modified(url, etag)
+
+        url = '/api/recipes/?limit=2&page=2'
+        etag = self.client.get(url)['ETag']
+        self.recipes[0].delete()
+        self.assert_modified(url, etag)
+
+    def test_ingredient_edited_directly(self):
+        recipe = self.recipes[-1]
+        row = IngredientRecipe.objects.create(
+            recipe=recipe, amount=1, ingredient=Ingredient.objects.create(
+                name='ingredient', measurement_unit='г'))
+        urls = (f'/api/recipes/{recipe.id}/', '/api/recipes/?limit=2')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        row.amount = 5
+        row.save()
+        etags = [self.assert_modified(url, etag)
+                 for url, etag in zip(urls, etags)]
+
+        row.delete()
+        for url, etag in zip(urls, etags):
+            self.assert_modified(url, etag)
+
+    def test_anonymous_last_modified(self):
+        client = APIClient()
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        response = client.get(url)
+        response = client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+
+class RecipeRepresentationCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        cls.tag = Tag.objects.create(name='breakfast', color='#aaaaaa',
+                                     slug='breakfast')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='recipe', text='text', cooking_time=1)
+        cls.recipe.tags.set([cls.tag])
+        Subscribe.objects.create(user=cls.reader, author=cls.author)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipe)
+
+    def setUp(self):
+        get_shared_cache().clear()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def test_user_flags_are_not_cached(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        data = client.get(self.url).data
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+        data = APIClient().get(self.url).data
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['author']['is_subscribed'])
+
+        data = client.get(self.url).data
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+    def test_invalidation(self):
+        client = APIClient()
+        client.get(self.url)
+
+        self.tag.name = 'завтрак'
+        self.tag.save()
+        self.assertEqual(client.get(self.url).data['tags'][0]['name'],
+                         'завтрак')
+
+        self.author.first_name = 'Иван'
+        self.author.save()
+        self.assertEqual(client.get(self.url).data['author']['first_name'],
+                         'Иван')
+
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.name = 'new name'
+        recipe.save()
+        self.assertEqual(client.get(self.url).data['name'], 'new name')
+
+    def test_ingredient_rows_edited_directly(self):
+        ingredient = Ingredient.objects.create(name='ingredient',
+                                               measurement_unit='г')
+        row = IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=ingredient, amount=1)
+        client = APIClient()
+        self.assertEqual(client.get(self.url).data['ingredients'][0]['amount'],
+                         1)
+
+        row.amount = 5
+        row.save()
+        self.assertEqual(client.get(self.url).data['ingredients'][0]['amount'],
+                         5)
+
+        row.delete()
+        self.assertEqual(client.get(self.url).data['ingredients'], [])
+
+
+class FastRepresentationTest(TestCase):
+    """Быстрые представления должны отдавать в точности тот же JSON,
+    что и сериализаторы DRF."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        tags = [
+            Tag.objects.create(name=name, color=color, slug=slug)
+            for name, color, slug in (('Ужин', '#aaaaaa', 'dinner'),
+                                      ('Завтрак', '#bbbbbb', 'breakfast'))
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент «{i}»',
+                                      measurement_unit='ст. л.')
+            for i in range(3)
+        ]
+        for i in range(2):
+            author = User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@foodgram.ru',
+                first_name='Имя', password='pass')
+            Subscribe.objects.create(user=cls.reader, author=author)
+            for j in range(3):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт "{j}"', text='Текст\n',
+                    cooking_time=j + 1,
+                    image=f'recipes/фото {i}-{j}.png' if j else '',
+                    thumbnail='recipes/thumbnails/t.jpg' if j > 1 else None)
+                recipe.tags.set(tags[:j])
+                IngredientRecipe.objects.bulk_create(
+                    IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                     amount=j * 10 + k + 1)
+                    for k, ingredient in enumerate(reversed(ingredients)))
+
+    def setUp(self):
+        self.request = APIRequestFactory().get('/api/recipes/')
+
+    def assert_same_json(self, fast, reference):
+        render = JSONRenderer().render
+        self.assertEqual(render(fast), render(reference))
+
+    def test_recipe_data(self):
+        recipes = list(Recipe.objects.prefetch_related(
+            'tags',
+            'ingredientrecipe_set__ingredient',
+            Prefetch('author', queryset=User.objects.annotate(
+                is_subscribed=Value(False))),
+        ).annotate(is_favorited=Value(False),
+                   is_in_shopping_cart=Value(False)))
+        reference = GetRecipeSerializer(
+            recipes, many=True, context={'request': self.request}).data
+        self.assert_same_json(recipe_data(recipes, self.request), reference)
+
+    def test_short_recipe_data(self):
+        for recipe in Recipe.objects.all():
+            self.assert_same_json(short_recipe_data(recipe),
+                                  ShortRecipeSerializer(recipe).data)
+
+    def test_subscription_data(self):
+        recipes = Recipe.objects.filter(pk__in=Recipe.objects.filter(
+            author=OuterRef('author')).values('pk')[:2])
+        authors = User.objects.filter(
+            following__user=self.reader
+        ).annotate(is_subscribed=Value(True)).order_by('id')
+        reference = SubscribeSerializer(
+            authors.prefetch_related(Prefetch('recipes', queryset=recipes)),
+            many=True,
+            context={'request': self.request, 'recipes_limit': 2},
+        ).data
+        self.assert_same_json(subscription_data(list(authors), recipes),
+                              reference)
+
+
+class FastJSONTest(TestCase):
+    data = {
+        'name': 'Рецепт\u2028"с кавычками"',
+        'amount': decimal.Decimal('1.50'),
+        'created': datetime.datetime(2023, 1, 2, 3, 4, 5, 123456,
+                                     tzinfo=timezone.utc),
+        'day': datetime.date(2023, 1, 2),
+        'label': gettext_lazy('Рецепт'),
+        'errors': {0: ['Ошибка'], 2: ['Ошибка']},
+        'items': ({'id': 1}, [2]),
+    }
+
+    def test_renders_like_json_renderer(self):
+        expected = JSONRenderer().render(self.data)
+        self.assertEqual(FastJSONRenderer().render(self.data), expected)
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, 'application/json; indent=2'),
+            JSONRenderer().render(self.data, 'application/json; indent=2'))
+        # Такие целые orjson не поддерживает.
+        self.assertEqual(FastJSONRenderer().render([2 ** 70]),
+                         JSONRenderer().render([2 ** 70]))
+        with mock.patch('api.v1.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), expected)
+
+    def assert_parses_like_json_parser(self):
+        body = '{"name": "Рецепт", "ingredients": [{"id": 1}]}'.encode()
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)),
+                         JSONParser().parse(BytesIO(body)))
+        for invalid in (b'{"name": ', b'[NaN]'):
+            with self.assertRaises(ParseError):
+                FastJSONParser().parse(BytesIO(invalid))
+
+    def test_parser(self):
+        self.assert_parses_like_json_parser()
+        with mock.patch('api.v1.parsers.orjson', None):
+            self.assert_parses_like_json_parser()
+
+    def test_api_uses_fast_json(self):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        Recipe.objects.create(author=author, name='Рецепт', text='text',
+                              cooking_time=1)
+        response = self.client.get('/api/recipes/')
+        self.assertIsInstance(response.accepted_renderer, FastJSONRenderer)
+        self.assertEqual(json.loads(response.content)['count'], 1)
+
+
+class BulkUserRecipesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@foodgram.ru', password='pass')
+        ingredients = [
+            Ingredient.objects.create(name=f'ingredient{i}',
+                                      measurement_unit='г')
+            for i in range(3)
+        ]
+        cls.recipes = []
+        for i in range(6):
+            recipe = Recipe.objects.create(
+                author=cls.user, name=f'recipe{i}', text='text',
+                cooking_time=1)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=i + 1)
+                for ingredient in ingredients[:i % 3 + 1])
+            cls.recipes.append(recipe)
+        # bulk_create не обновляет ingredients_count.
+        rebuild_counters()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_consistent(self):
+        self.assertEqual(carts_drift(), 0)
+        self.assertFalse(any(drift for _, _, drift in counters_drift()))
+
+    def test_bulk_add_and_remove(self):
+        ids = [recipe.id for recipe in self.recipes]
+        for url in ('/api/recipes/favorite/', '/api/recipes/shopping_cart/'):
+            with self.subTest(url=url):
+                self.client.post(url, {'recipes': ids[:1]}, format='json')
+                response = self.client.post(
+                    url, {'recipes': ids[:3] + [0, 999]}, format='json')
+                self.assertEqual(response.status_code, 400)
+                response = self.client.post(
+                    url, {'recipes': ids[:3] + [999]}, format='json')
+                self.assertEqual(response.data, {
+                    str(ids[0]): 'exists', str(ids[1]): 'created',
+                    str(ids[2]): 'created', '999': 'not_found'})
+                self.assert_consistent()
+
+                response = self.client.delete(
+                    url, {'recipes': ids[1:]}, format='json')
+                self.assertEqual(response.data, {
+                    str(pk): 'deleted' if pk in ids[1:3] else 'absent'
+                    for pk in ids[1:]})
+                self.assert_consistent()
+
+    def test_bulk_queries_do_not_depend_on_count(self):
+        ids = [recipe.id for recipe in self.recipes]
+        for count in (2, 6):
+            with self.subTest(count=count):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.post('/api/recipes/shopping_cart/',
+                                     {'recipes': ids[:count]}, format='json')
+                    self.client.delete('/api/recipes/shopping_cart/',
+                                       {'recipes': ids[:count]},
+                                       format='json')
+                if count == 2:
+                    expected = len(queries)
+                self.assertEqual(len(queries), expected)
+                self.assert_consistent()
+
+    def test_single_endpoints_are_idempotent(self):
+        recipe = self.recipes[0]
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{recipe.id}/{action}/'
+            with self.subTest(action=action):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                response = self.client.post(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.data['id'], recipe.id)
+                self.assert_consistent()
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assert_consistent()
+
+    def test_anonymous(self):
+        response = APIClient().post('/api/recipes/favorite/',
+                                    {'recipes': [self.recipes[0].id]},
+                                    format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class RecipeSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        chicken = Ingredient.objects.create(name='курица',
+                                            measurement_unit='г')
+        cls.tag = Tag.objects.create(name='обед', color='#aaaaaa',
+                                     slug='lunch')
+        cls.recipes = {}
+        for name, text, ingredient in (
+                ('курица в соусе', 'варить час', chicken),
+                ('плов', 'курица и рис', None),
+                ('салат', 'нарезать овощи', chicken),
+                ('компот', 'варить ягоды', None)):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text=text, cooking_time=1)
+            if ingredient:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=100)
+            cls.recipes[name] = recipe
+        cls.recipes['салат'].tags.set([cls.tag])
+
+    def names(self, query):
+        response = self.client.get(f'/api/recipes/?limit=10&{query}')
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data['results']]
+
+    def test_search_fields(self):
+        self.assertEqual(sorted(self.names('search=варить')),
+                         ['компот', 'курица в соусе'])
+        self.assertEqual(self.names('search=салат'), ['салат'])
+        self.assertEqual(self.names('search=курица соусе'),
+                         ['курица в соусе'])
+        self.assertEqual(self.names('search=ананас'), [])
+        self.assertEqual(len(self.names('search=')), 4)
+
+    def test_ranking_and_filters(self):
+        names = self.names('search=курица')
+        self.assertEqual(sorted(names),
+                         ['курица в соусе', 'плов', 'салат'])
+        # Совпадение в названии важнее совпадений в ингредиентах и тексте.
+        self.assertEqual(names[0], 'курица в соусе')
+        self.assertEqual(self.names('search=курица&tags=lunch'), ['салат'])
+        self.assertEqual(
+            self.names('search=курица&ordering=pub_date'),
+            ['курица в соусе', 'плов', 'салат'])
+
+    def test_vector_follows_ingredients(self):
+        recipe = self.recipes['компот']
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=Ingredient.objects.create(
+                name='вишня', measurement_unit='г'), amount=1)
+        self.assertEqual(self.names('search=вишня'), ['компот'])
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_search_vectors', stdout=out)
+        self.assertIn('PostgreSQL', out.getvalue())
+        with mock.patch('recipes.search.search_vectors_supported',
+                        return_value=True):
+            with mock.patch('recipes.search.update_search_vectors') as update:
+                call_command('rebuild_search_vectors', batch_size=3,
+                             stdout=StringIO())
+        batches = [args[0] for args, _ in update.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [3, 1])
+        self.assertEqual(
+            sorted(itertools.chain.from_iterable(batches)),
+            sorted(recipe.id for recipe in self.recipes.values()))
+
+
+class CookableRecipesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@foodgram.ru', password='pass')
+        cls.ingredients = {
+            name: Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in 'abcd'
+        }
+        cls.recipes = {}
+        for name, names in (('ab', 'ab'), ('abc', 'abc'), ('cd', 'cd'),
+                            ('a', 'a')):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=name, text='text', cooking_time=1)
+            for ingredient in names:
+                IngredientRecipe.objects.create(
+                    recipe=recipe, ingredient=cls.ingredients[ingredient],
+                    amount=1)
+            cls.recipes[name] = recipe
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def cookable(self, names, missing=None):
+        query = '&'.join(f'ingredients={self.ingredients[name].id}'
+                         for name in names)
+        if missing is not None:
+            query += f'&missing={missing}'
+        response = self.client.get(f'/api/recipes/cookable/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(item['name'], item['matched_ingredients'],
+                 item['missing_ingredients'])
+                for item in response.data['results']]
+
+    def test_coverage(self):
+        self.assertEqual(self.cookable('ab'), [('ab', 2, 0), ('a', 1, 0)])
+        self.assertEqual(self.cookable('ab', missing=1),
+                         [('ab', 2, 0), ('a', 1, 0), ('abc', 2, 1)])
+        self.assertEqual(self.cookable('d', missing=1), [('cd', 1, 1)])
+        self.assertEqual(self.cookable('abcd'), [
+            ('abc', 3, 0), ('cd', 2, 0), ('ab', 2, 0), ('a', 1, 0)])
+
+    def test_follows_recipe_changes(self):
+        recipe = self.recipes['abc']
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [{'id': self.ingredients[name].id, 'amount': 1}
+                             for name in 'ab']},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.cookable('ab'),
+                         [('abc', 2, 0), ('ab', 2, 0), ('a', 1, 0)])
+        IngredientRecipe.objects.get(
+            recipe=recipe, ingredient=self.ingredients['b']).delete()
+        self.assertEqual(self.cookable('a'), [('a', 1, 0), ('abc', 1, 0)])
+        self.assertFalse(any(drift for _, _, drift in counters_drift()))
+
+    def test_fixed_queries(self):
+        get_shared_cache().clear()
+        for names in ('a', 'abcd'):
+            # Количество, строки страницы, рецепты и три запроса для
+            # представлений, которых нет в кеше.
+            with self.assertNumQueries(6):
+                self.cookable(names, missing=2)
+
+    def test_invalid_params(self):
+        for query in ('', 'ingredients=abc', 'ingredients=1&missing=-1'):
+            response = self.client.get(f'/api/recipes/cookable/?{query}')
+            self.assertEqual(response.status_code, 400)
+
+
+class RecommendationsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@foodgram.ru',
+                password='pass')
+            for i in range(4)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.users[0], name=f'recipe{i}', text='text',
+                cooking_time=1)
+            for i in range(5)
+        ]
+        for user, recipes in ((0, (0, 1)), (1, (0, 1, 2)), (2, (1, 2)),
+                              (3, (3, ))):
+            for recipe in recipes:
+                Favorite.objects.create(
+                    user=cls.users[user], recipe=cls.recipes[recipe])
+        ShoppingCart.objects.create(
+            user=cls.users[3], recipe=cls.recipes[0])
+
+    def setUp(self):
+        get_shared_cache().clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[2])
+
+    def neighbours(self, recipe):
+        row = RecipeNeighbours.objects.get(recipe=recipe)
+        return [self.names[pk] for pk in row.recipes], row.scores
+
+    @property
+    def names(self):
+        return dict(Recipe.objects.values_list('id', 'name'))
+
+    def update(self, *args):
+        out = StringIO()
+        call_command('update_recommendations', *args, stdout=out)
+        return out.getvalue()
+
+    def set_neighbours(self, recipe, neighbours):
+        RecipeNeighbours.objects.create(
+            recipe=self.recipes[recipe],
+            recipes=[self.recipes[i].id for i, _ in neighbours],
+            scores=[score for _, score in neighbours])
+
+    @skipUnless(scipy, 'нужны numpy и scipy')
+    def test_update(self):
+        self.assertIn('Пересчитано рецептов: 5', self.update())
+        self.assertEqual(self.neighbours(self.recipes[0]), (
+            ['recipe1', 'recipe2', 'recipe3'], [0.7698, 0.4714, 0.3333]))
+        self.assertEqual(self.neighbours(self.recipes[3]),
+                         (['recipe0'], [0.3333]))
+        self.assertEqual(self.neighbours(self.recipes[4]), ([], []))
+        self.assertIn('Пересчитано рецептов: 0', self.update())
+
+        Favorite.objects.create(user=self.users[3], recipe=self.recipes[2])
+        self.assertIn('Пересчитано рецептов: 1', self.update())
+        self.assertEqual(self.neighbours(self.recipes[2])[0],
+                         ['recipe1', 'recipe0', 'recipe3'])
+        self.assertIn('Пересчитано рецептов: 5', self.update('--full'))
+        self.assertEqual(self.neighbours(self.recipes[3])[0],
+                         ['recipe2', 'recipe0'])
+        self.update('--full', '--neighbours', '1')
+        self.assertEqual(self.neighbours(self.recipes[0])[0], ['recipe1'])
+
+    def test_without_numeric_libraries(self):
+        with mock.patch.dict('sys.modules', {'numpy': None}):
+            with self.assertRaisesMessage(CommandError, 'numpy и scipy'):
+                self.update()
+
+    def test_similar(self):
+        self.set_neighbours(0, ((2, 0.9), (1, 0.5), (3, 0.1)))
+        url = f'/api/recipes/{self.recipes[0].id}/similar/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data],
+                         ['recipe2', 'recipe1', 'recipe3'])
+        self.assertEqual(
+            [item['is_favorited'] for item in response.data], [True] * 2
+            + [False])
+        response = APIClient().get(f'{url}?limit=1')
+        self.assertEqual([item['name'] for item in response.data],
+                         ['recipe2'])
+
+        self.recipes[1].delete()
+        self.assertEqual([item['name'] for item in self.client.get(
+            url).data], ['recipe2', 'recipe3'])
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[4].id}/similar/')
+        self.assertEqual(response.data, [])
+        for pk in (0, 'abc'):
+            response = self.client.get(f'/api/recipes/{pk}/similar/')
+            self.assertEqual(response.status_code, 404)
+
+    def test_recommended(self):
+        # У пользователя в избранном recipe1 и recipe2.
+        self.set_neighbours(1, ((0, 0.7), (2, 0.6), (4, 0.2)))
+        self.set_neighbours(2, ((1, 0.6), (3, 0.5), (4, 0.4)))
+        self.set_neighbours(3, ((0, 1.0), ))
+        # Два запроса истории пользователя, списки соседей, рецепты с
+        # флагами и три запроса на представления рецептов, которых нет
+        # в кеше.
+        with self.assertNumQueries(7):
+            response = self.client.get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['name'] for item in response.data],
+                         ['recipe0', 'recipe4', 'recipe3'])
+        response = self.client.get('/api/recipes/recommended/?limit=2')
+        self.assertEqual(len(response.data), 2)
+
+        # Единственный сосед рецептов пользователя уже у него в корзине.
+        self.client.force_authenticate(self.users[3])
+        self.assertEqual(self.client.get('/api/recipes/recommended/').data,
+                         [])
+        response = APIClient().get('/api/recipes/recommended/')
+        self.assertEqual(response.status_code, 401)
+
+
+class TimelineTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, *cls.authors = [
+            User.objects.create_user(
+                username=f'user{i}', email=f'user{i}@foodgram.ru',
+                password='pass')
+            for i in range(5)
+        ]
+        # Рецепты создаются по очереди от разных авторов: recipe0 самый
+        # старый.
+        for i in range(8):
+            Recipe.objects.create(
+                author=cls.authors[i % 4], name=f'recipe{i}', text='text',
+                cooking_time=1)
+        for author in cls.authors[:2]:
+            Subscribe.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        get_shared_cache().clear()
+        self.client = APIClient()
+
+    def timeline(self, limit=2):
+        """Все страницы ленты читателя по ссылкам next."""
+        self.client.force_authenticate(User.objects.get(pk=self.reader.pk))
+        names = []
+        url = f'/api/recipes/timeline/?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            names.extend(item['name'] for item in response.data['results'])
+            url = response.data['next']
+        return names
+
+    def follow(self, author):
+        Subscribe.objects.create(user=self.reader, author=author)
+
+    def unfollow(self, author):
+        Subscribe.objects.filter(user=self.reader, author=author).delete()
+
+    def test_pull(self):
+        self.assertEqual(
+            self.timeline(),
+            ['recipe5', 'recipe4', 'recipe1', 'recipe0'])
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.follow(self.authors[2])
+        self.assertEqual(self.timeline(3), [
+            'recipe6', 'recipe5', 'recipe4', 'recipe2', 'recipe1',
+            'recipe0'])
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(APIClient().get(
+            '/api/recipes/timeline/').status_code, 401)
+
+    @override_settings(TIMELINE_INBOX_THRESHOLD=3)
+    def test_inbox(self):
+        self.follow(self.authors[2])
+        self.assertEqual(TimelineEntry.objects.count(), 6)
+        self.assertEqual(self.timeline(), [
+            'recipe6', 'recipe5', 'recipe4', 'recipe2', 'recipe1',
+            'recipe0'])
+
+        self.follow(self.authors[3])
+        Recipe.objects.create(
+            author=self.authors[0], name='recipe8', text='text',
+            cooking_time=1)
+        Recipe.objects.filter(name='recipe4').delete()
+        self.assertEqual(self.timeline(3), [
+            'recipe8', 'recipe7', 'recipe6', 'recipe5', 'recipe3',
+            'recipe2', 'recipe1', 'recipe0'])
+        self.assertEqual(timelines_drift(), 0)
+
+        self.unfollow(self.authors[0])
+        self.assertEqual(self.timeline(), [
+            'recipe7', 'recipe6', 'recipe5', 'recipe3', 'recipe2',
+            'recipe1'])
+        self.assertEqual(timelines_drift(), 0)
+        # Ниже порога лента удаляется и снова выбирается по авторам.
+        self.unfollow(self.authors[1])
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.timeline(), ['recipe7', 'recipe6', 'recipe3',
+                                           'recipe2'])
+        self.assertFalse(any(drift for _, _, drift in counters_drift()))
+
+    def test_threshold_change(self):
+        for author in self.authors[2:]:
+            self.follow(author)
+        expected = self.timeline()
+        with override_settings(TIMELINE_INBOX_THRESHOLD=4):
+            self.assertEqual(timelines_drift(), 8)
+            rebuild_timelines()
+            self.assertEqual(timelines_drift(), 0)
+            self.assertEqual(self.timeline(), expected)
+            # Курсор, выданный до пересборки, продолжает работать.
+            with override_settings(TIMELINE_INBOX_THRESHOLD=5):
+                self.client.force_authenticate(
+                    User.objects.get(pk=self.reader.pk))
+                cursor = self.client.get(
+                    '/api/recipes/timeline/?limit=3').data['next']
+            self.assertEqual(
+                [item['name'] for item in self.client.get(
+                    cursor).data['results']],
+                expected[3:6])
+
+    def test_fixed_queries(self):
+        authors = User.objects.bulk_create(
+            User(username=f'author{i}', email=f'author{i}@foodgram.ru')
+            for i in range(30))
+        for author in authors:
+            self.follow(author)
+        reader = User.objects.get(pk=self.reader.pk)
+        self.client.force_authenticate(reader)
+        # Страница ленты (строки ленты и рецепты) и три запроса на
+        # представления рецептов, которых нет в кеше.
+        for threshold, queries in ((100, 4), (10, 5)):
+            with override_settings(TIMELINE_INBOX_THRESHOLD=threshold):
+                rebuild_timelines()
+                get_shared_cache().clear()
+                with self.assertNumQueries(queries):
+                    self.client.get('/api/recipes/timeline/?limit=3')
@@ -0,0 +1,100 @@
+"""Лента подписок: рецепты авторов, на которых подписан пользователь,
+от новых к старым.
+
+Ленту пользователя с небольшим числом подписок выбирает один запрос
+author IN (подписки) по индексу (author, -pub_date, -id). Для
+пользователей, подписанных хотя бы на TIMELINE_INBOX_THRESHOLD авторов,
+такой запрос дорожает с числом подписок, поэтому их лента раскладывается
+заранее в TimelineEntry: новый рецепт сразу записывается в ленты
+подписчиков, и страница читается одним диапазоном индекса
+(user, -pub_date, -recipe)."""
+from django.conf import settings
+from django.db import transaction
+from users.models import Subscribe, User
+
+from .models import TimelineEntry
+
+
+def uses_inbox(user):
+    return user.subscriptions_count >= settings.TIMELINE_INBOX_THRESHOLD
+
+
+def inbox_entries(subscriptions):
+    """Строки лент по подпискам subscriptions: все рецепты их авторов."""
+    rows = subscriptions.filter(author__recipes__isnull=False).values_list(
+        'user_id', 'author_id', 'author__recipes__id',
+        'author__recipes__pub_date').order_by()
+    return (
+        TimelineEntry(user_id=user_id, author_id=author_id,
+                      recipe_id=recipe_id, pub_date=pub_date)
+        for user_id, author_id, recipe_id, pub_date in rows.iterator()
+    )
+
+
+def recipe_published(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора, которые их
+    ведут, двумя запросами независимо от числа подписчиков."""
+    followers = Subscribe.objects.filter(
+        author_id=recipe.author_id,
+        user__subscriptions_count__gte=settings.TIMELINE_INBOX_THRESHOLD,
+    ).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, author_id=recipe.author_id,
+                       recipe_id=recipe.id, pub_date=recipe.pub_date)
+         for user_id in followers),
+        ignore_conflicts=True,
+    )
+
+
+def subscriptions_count(user_id):
+    return User.objects.filter(pk=user_id).values_list(
+        'subscriptions_count', flat=True).first() or 0
+
+
+@transaction.atomic
+def author_followed(user_id, author_id):
+    """Вызывается после увеличения счетчика подписок. Когда пользователь
+    достигает порога, его лента раскладывается целиком, дальше в нее
+    добавляются только рецепты нового автора."""
+    count = subscriptions_count(user_id)
+    if count < settings.TIMELINE_INBOX_THRESHOLD:
+        return
+    subscriptions = Subscribe.objects.filter(user_id=user_id)
+    if count > settings.TIMELINE_INBOX_THRESHOLD:
+        subscriptions = subscriptions.filter(author_id=author_id)
+    TimelineEntry.objects.bulk_create(
+        inbox_entries(subscriptions), ignore_conflicts=True)
+
+
+def author_unfollowed(user_id, author_id):
+    """Вызывается после уменьшения счетчика подписок. Ниже порога лента
+    больше не нужна и удаляется целиком."""
+    entries = TimelineEntry.objects.filter(user_id=user_id)
+    if subscriptions_count(user_id) >= settings.TIMELINE_INBOX_THRESHOLD:
+        entries = entries.filter(author_id=author_id)
+    entries.delete()
+
+
+def expected_entries():
+    return inbox_entries(Subscribe.objects.filter(
+        user__subscriptions_count__gte=settings.TIMELINE_INBOX_THRESHOLD))
+
+
+def timelines_drift():
+    """Количество строк лент, расходящихся с подписками."""
+    fields = ('user_id', 'recipe_id', 'author_id', 'pub_date')
+    stored = set(TimelineEntry.objects.values_list(*fields))
+    expected = {
+        tuple(getattr(entry, field) for field in fields)
+        for entry in expected_entries()
+    }
+    return len(stored ^ expected)
+
+
+@transaction.atomic
+def rebuild_timelines(batch_size=5000):
+    """Пересобирает все ленты, например после изменения
+    TIMELINE_INBOX_THRESHOLD."""
+    TimelineEntry.objects.all().delete()
+    TimelineEntry.objects.bulk_create(
+        expected_entries(), batch_size=batch_size)
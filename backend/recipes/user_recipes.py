@@ -0,0 +1,75 @@
+from django.db import transaction
+from django.db.models import F
+from users.models import User
+
+from . import cart
+from .counters import delete_counted
+from .models import (BulkFavorite, BulkShoppingCart, Favorite, Recipe,
+                     ShoppingCart)
+
+# Счетчик рецепта, который меняется вместе с таблицей.
+COUNTER_FIELDS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'cart_count',
+}
+
+# Прокси-модели без сигналов для пакетного удаления.
+BULK_MODELS = {
+    Favorite: BulkFavorite,
+    ShoppingCart: BulkShoppingCart,
+}
+
+
+def lock_user(user_id):
+    """Блокирует строку пользователя до конца транзакции, чтобы
+    параллельные запросы одного пользователя не посчитали одну и ту же
+    запись дважды."""
+    list(User.objects.select_for_update().filter(
+        pk=user_id).values_list('pk'))
+
+
+def existing_recipes(model, user_id, recipe_ids):
+    return set(model.objects.filter(
+        user_id=user_id, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+
+
+@transaction.atomic
+def add_user_recipes(model, user_id, recipe_ids):
+    """Добавляет рецепты в избранное или корзину (model) пользователя
+    одним bulk_create и возвращает множество id добавленных рецептов.
+    Уже добавленные рецепты пропускаются. bulk_create не отправляет
+    post_save, поэтому счетчики рецептов и сводный список покупок
+    меняются здесь же, пачкой."""
+    lock_user(user_id)
+    created = set(recipe_ids) - existing_recipes(model, user_id, recipe_ids)
+    if not created:
+        return created
+    model.objects.bulk_create(
+        (model(user_id=user_id, recipe_id=recipe_id)
+         for recipe_id in created),
+        ignore_conflicts=True,
+    )
+    field = COUNTER_FIELDS[model]
+    Recipe.objects.filter(
+        pk__in=created).update(**{field: F(field) + 1})
+    if model is ShoppingCart:
+        cart.add_recipes(user_id, created)
+    return created
+
+
+@transaction.atomic
+def remove_user_recipes(model, user_id, recipe_ids):
+    """Удаляет рецепты из избранного или корзины и возвращает множество
+    id удаленных рецептов. Строки удаляются через delete_counted, которое
+    уменьшает счетчики рецептов пачкой, а сводный список покупок
+    уменьшается здесь же, как и в add_user_recipes."""
+    lock_user(user_id)
+    deleted = existing_recipes(model, user_id, recipe_ids)
+    if not deleted:
+        return deleted
+    if model is ShoppingCart:
+        cart.remove_recipes(user_id, deleted)
+    delete_counted(BULK_MODELS[model].objects.filter(
+        user_id=user_id, recipe_id__in=deleted))
+    return deleted
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.4 on 2026-10-18 02:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_subscriptions_count(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Subscribe = apps.get_model('users', 'Subscribe')
+    User.objects.update(subscriptions_count=Coalesce(Subquery(
+        Subscribe.objects.filter(user=OuterRef('pk')).order_by()
+        .values('user').annotate(count=Count('pk')).values('count')
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='subscriptions_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписок'),
+        ),
+        migrations.RunPython(
+            fill_subscriptions_count, migrations.RunPython.noop),
+    ]
@@ -11,6 +11,16 @@ class User(AbstractUser):
         'last_name',
     ]
     email = models.EmailField('Email адрес', unique=True)
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    subscriptions_count = models.PositiveIntegerField(
+        'Количество подписок',
+        default=0,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
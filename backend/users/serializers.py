@@ -1,9 +1,10 @@
+from api.profiling import ProfiledSerializerMixin
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
 from users.models import User
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(ProfiledSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     class Meta:
@@ -17,6 +18,8 @@ class CustomUserSerializer(UserSerializer):
                   )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (user.is_authenticated
                 and obj.following.filter(user=user).exists())
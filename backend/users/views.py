@@ -1,16 +1,42 @@
-from api.v1.serializers import SubscribeSerializer
+from api.v1.pagination import (OptionalKeysetPaginationMixin,
+                               SubscriptionKeysetPagination)
+from api.v1.serializers import SubscribeSerializer, subscription_data
+from django.conf import settings
+from django.db.models import OuterRef, Value
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
-from rest_framework import status
+from recipes.models import Recipe
+from rest_framework import serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from users.models import Subscribe, User
 from users.serializers import CustomUserSerializer
 
 
-class CustomUserViewSet(UserViewSet):
+class CustomUserViewSet(OptionalKeysetPaginationMixin, UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
+    keyset_pagination_class = SubscriptionKeysetPagination
+
+    def get_recipes_limit(self):
+        """Значение параметра recipes_limit. Если параметр не передан,
+        используется SUBSCRIPTION_RECIPES_LIMIT, чтобы размер ответа
+        оставался ограниченным."""
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is None:
+            return settings.SUBSCRIPTION_RECIPES_LIMIT
+        field = serializers.IntegerField(min_value=1)
+        try:
+            return field.run_validation(recipes_limit)
+        except serializers.ValidationError as error:
+            raise serializers.ValidationError(
+                {'recipes_limit': error.detail})
+
+    def get_subscribe_context(self):
+        return {
+            'request': self.request,
+            'recipes_limit': self.get_recipes_limit(),
+        }
 
     @action(methods=['post', 'delete'], detail=True)
     def subscribe(self, request, id):
@@ -20,7 +46,7 @@ class CustomUserViewSet(UserViewSet):
             serializer = SubscribeSerializer(
                 author,
                 data=request.data,
-                context={'request': request}
+                context=self.get_subscribe_context()
             )
             serializer.is_valid(raise_exception=True)
             Subscribe.objects.create(user=request.user, author=author)
@@ -37,11 +63,17 @@ class CustomUserViewSet(UserViewSet):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        subscription_list = User.objects.filter(following__user=request.user)
+        context = self.get_subscribe_context()
+        recipes = Recipe.objects.all()
+        if context['recipes_limit']:
+            recipes = recipes.filter(pk__in=Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('pk')[:context['recipes_limit']])
+        subscription_list = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True)
+        ).order_by('id')
         pages = self.paginate_queryset(subscription_list)
-        serializer = SubscribeSerializer(
-            pages,
-            many=True,
-            context={'request': request}
-        )
-        return self.get_paginated_response(serializer.data)
+        return self.get_paginated_response(
+            subscription_data(pages, recipes))